@@ -0,0 +1,335 @@
+#! /usr/bin/env python3
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import statistics
+import subprocess
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from downloader import STATUS_OK, STATUS_FAILED
+from scrapper import create_scrapper
+from hosts import HostScheduler
+import standin
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+"""
+Offline benchmark: scrapes and downloads from local stand-in (standin.py) instead of real engines and hosts,
+so runs are reproducible and can be compared before and after a change.
+
+Every case (backend, engine, workers) runs in its own fresh process, so peak RSS belongs to that case only.
+Case first runs search alone to measure urls/s, then full scrape_and_download to measure images/s
+and p50/p99 download latency. Results are printed and saved to Bench/<time>.json.
+
+--startup measures startup instead: GUI imports and first window, then chromedriver resolution without
+and with driver cache and browser start, every step in fresh interpreter.
+
+Usage: python benchmark.py --backends http,browser --workers 1,4,8 --images 200 --latency 0.05 --fail-rate 0.02
+       python benchmark.py --compare Bench/20240101-120000.json
+       python benchmark.py --startup --repeat 5
+"""
+
+BENCH_DIR = os.path.join(os.path.dirname(__file__), 'Bench')
+QUERY = 'benchmark'
+#  compared metrics and whether bigger value is better
+COMPARED = {'urls_per_sec': True, 'images_per_sec': True, 'p50': False, 'p99': False, 'peak_rss_mb': False}
+#  startup step -> (setup, timed code), run in fresh interpreter, {cache} is driver cache file of the run
+STARTUP_STEPS = {
+    'gui_import': ('', 'import main'),
+    'first_window': ('', 'import main; window = main.MainWindow(); window.update(); window.destroy()'),
+    'driver_resolve_cold': ('import driver_pool', 'driver_pool.driver_path(cache_path={cache!r})'),
+    'driver_resolve_cached': ('import driver_pool', 'driver_pool.driver_path(cache_path={cache!r})'),
+    'browser_start': ('import driver_pool', 'driver_pool.create_driver(cache_path={cache!r}).quit()'),
+}
+_TIMED_SCRIPT = '''
+import sys, time
+sys.path.insert(0, {root!r})
+{setup}
+start = time.perf_counter()
+{code}
+print(time.perf_counter() - start)
+'''
+
+
+def percentile(values: list, q: float) -> float or None:
+    """
+    Nearest rank percentile
+
+    :param values: list of numbers
+    :param q: 0..1
+    :return: value or None if values are empty
+    """
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[max(0, min(len(ordered) - 1, round(q * len(ordered)) - 1))]
+
+
+def _peak_rss_mb(who) -> float or None:
+    if resource is None:
+        return None
+    peak = resource.getrusage(who).ru_maxrss
+    #  kilobytes on Linux, bytes on macOS
+    return round(peak / (1024 ** 2 if sys.platform == 'darwin' else 1024), 1)
+
+
+def run_case(case: dict, url_templates: dict, download_root: str, scheduling: dict) -> dict:
+    """
+    Runs one benchmark case, called in fresh process
+
+    :param case: dict with backend, engine, workers, images and thumbnails
+    :param url_templates: scrapper url_templates pointing to stand-in
+    :param download_root: where to save images, removed by caller
+    :param scheduling: HostScheduler() params
+    :return: case result
+    """
+    result = dict(case)
+    options = {'thumbnails': True} if case.get('thumbnails') else {}
+    try:
+        scrapper = create_scrapper(backend=case['backend'], url_templates=url_templates)
+        try:
+            start = time.perf_counter()
+            urls = list(scrapper.iter_image_urls(search_engine=case['engine'], query=QUERY,
+                                                 max_urls=case['images'], **options))
+            search_time = time.perf_counter() - start
+        finally:
+            scrapper.close()
+
+        scrapper = create_scrapper(backend=case['backend'], url_templates=url_templates)
+        scrapper.download_root = download_root
+        scrapper.scheduler = HostScheduler(**scheduling, max_per_host=case['workers'])
+        start = time.perf_counter()
+        scrapper.scrape_and_download(search_engine=case['engine'], query=QUERY, max_urls=case['images'],
+                                     workers=case['workers'], **options)
+        total_time = time.perf_counter() - start
+
+        results = scrapper.download_results
+        latencies = [download.elapsed for download in results if download.status == STATUS_OK]
+        result.update({
+            'urls': len(urls),
+            'urls_per_sec': round(len(urls) / search_time, 2) if search_time else None,
+            'images': len(latencies),
+            'failed': sum(download.status == STATUS_FAILED for download in results),
+            'images_per_sec': round(len(latencies) / total_time, 2) if total_time else None,
+            'p50': percentile(latencies, 0.5),
+            'p99': percentile(latencies, 0.99),
+            'total_time': round(total_time, 3),
+        })
+    except Exception as err:
+        result['error'] = f'{type(err).__name__}: {err}'
+    result['peak_rss_mb'] = _peak_rss_mb(resource.RUSAGE_SELF) if resource else None
+    result['children_peak_rss_mb'] = _peak_rss_mb(resource.RUSAGE_CHILDREN) if resource else None
+    return result
+
+
+def time_step(step: str, cache_path: str) -> float:
+    """
+    Runs startup step in fresh interpreter
+
+    :param step: STARTUP_STEPS key
+    :param cache_path: driver cache file
+    :return: seconds
+    """
+    setup, code = STARTUP_STEPS[step]
+    script = _TIMED_SCRIPT.format(root=os.path.dirname(os.path.abspath(__file__)), setup=setup,
+                                  code=code.format(cache=cache_path))
+    process = subprocess.run([sys.executable, '-c', script], capture_output=True, text=True, timeout=600)
+    if process.returncode:
+        raise RuntimeError(process.stderr.strip().splitlines()[-1] if process.stderr.strip() else 'failed')
+    return float(process.stdout.strip().splitlines()[-1])
+
+
+def run_startup(repeat: int) -> list:
+    """
+    Times every startup step repeat times, driver cache is empty before cold resolution of every round
+
+    :param repeat: rounds
+    :return: list of dicts with step, seconds (median) and error of failed step
+    """
+    timings = {step: [] for step in STARTUP_STEPS}
+    errors = {}
+    for _ in range(repeat):
+        cache_dir = tempfile.mkdtemp(prefix='bench-driver-')
+        try:
+            for step in STARTUP_STEPS:
+                try:
+                    timings[step].append(time_step(step, cache_path=os.path.join(cache_dir, 'driver_cache.json')))
+                except Exception as err:
+                    errors[step] = str(err)
+        finally:
+            shutil.rmtree(cache_dir, ignore_errors=True)
+    results = []
+    for step, values in timings.items():
+        result = {'step': step, 'seconds': round(statistics.median(values), 4) if values else None, 'runs': len(values)}
+        if step in errors:
+            result['error'] = errors[step]
+        results.append(result)
+    return results
+
+
+def print_startup(results: list, previous: dict = None) -> None:
+    """
+    Prints startup steps, with change against previous results in percent
+
+    :param results: run_startup() result
+    :param previous: step -> result of earlier run
+    :return: None
+    """
+    width = max(len(result['step']) for result in results)
+    for result in results:
+        old = (previous or {}).get(result['step'])
+        cell = _format(result['seconds'])
+        if old and old.get('seconds') and result['seconds'] is not None:
+            cell += f' ({(result["seconds"] - old["seconds"]) / old["seconds"]:+.0%})'
+        if 'error' in result:
+            cell += f'  {result["error"]}'
+        print(f'{result["step"].ljust(width)}  {cell}')
+
+
+def _median_result(runs: list) -> dict:
+    """
+    Merges repeats of the same case, numbers are medians of successful runs
+
+    :param runs: results of run_case
+    :return: merged result
+    """
+    ok_runs = [run for run in runs if 'error' not in run]
+    merged = dict(ok_runs[0] if ok_runs else runs[0])
+    merged['runs'] = len(runs)
+    for name in ('urls_per_sec', 'images_per_sec', 'p50', 'p99', 'peak_rss_mb', 'children_peak_rss_mb', 'failed'):
+        values = [run[name] for run in ok_runs if run.get(name) is not None]
+        if values:
+            merged[name] = round(statistics.median(values), 4)
+    return merged
+
+
+def case_key(result: dict) -> tuple:
+    return result['backend'], result['engine'], result['workers'], bool(result.get('thumbnails'))
+
+
+def _format(value) -> str:
+    if value is None:
+        return '-'
+    return f'{value:.3f}' if isinstance(value, float) and value < 10 else str(value)
+
+
+def print_table(results: list, previous: dict = None) -> None:
+    """
+    Prints results, with change against previous results in percent
+
+    :param results: merged case results
+    :param previous: case_key -> result of earlier run
+    :return: None
+    """
+    header = ['backend', 'engine', 'workers', 'urls/s', 'images/s', 'p50 s', 'p99 s', 'rss MB', 'failed']
+    rows = [header]
+    for result in results:
+        row = [result['backend'], result['engine'], str(result['workers'])]
+        if 'error' in result:
+            rows.append(row + [result['error']])
+            continue
+        old = (previous or {}).get(case_key(result))
+        for name in COMPARED:
+            cell = _format(result.get(name))
+            if old and old.get(name) and result.get(name) is not None:
+                cell += f' ({(result[name] - old[name]) / old[name]:+.0%})'
+            row.append(cell)
+        row.append(str(result.get('failed')))
+        rows.append(row)
+    #  error message of failed case is not a column, it just follows the case
+    widths = [max(len(row[i]) for row in rows if len(row) == len(header)) for i in range(len(header))]
+    for row in rows:
+        print('  '.join(cell.ljust(width) for cell, width in zip(row, widths + [0])).rstrip())
+
+
+def load_results(path: str) -> dict:
+    """
+    Reads saved benchmark
+
+    :param path: json file written by main()
+    :return: case_key -> result
+    """
+    with open(file=path, mode='r', encoding='UTF-8') as file:
+        results = json.load(file)['results']
+    return {result['step'] if 'step' in result else case_key(result): result for result in results}
+
+
+def main(argv: list = None) -> int:
+    parser = argparse.ArgumentParser(description='Offline scrape and download benchmark against local stand-in')
+    parser.add_argument('--backends', type=lambda value: value.split(','), default=['http'],
+                        help='comma separated, http,browser')
+    parser.add_argument('--engines', type=lambda value: value.split(','), default=['Google', 'Yandex'])
+    parser.add_argument('--workers', type=lambda value: [int(number) for number in value.split(',')],
+                        default=[1, 4, 8], help='download threads, comma separated')
+    parser.add_argument('--images', type=int, default=200, help='images per case')
+    parser.add_argument('--thumbnails', action='store_true', help='harvest thumbnails instead of full size images')
+    parser.add_argument('--size', default='640x480', help='generated image size WxH')
+    parser.add_argument('--latency', type=float, default=0.05, help='image response delay in seconds')
+    parser.add_argument('--page-latency', type=float, default=0.0, help='result page delay in seconds')
+    parser.add_argument('--fail-rate', type=float, default=0.0, help='share of failed image responses')
+    parser.add_argument('--host-rate', type=float, default=1000, help='requests per second to stand-in host')
+    parser.add_argument('--retries', type=int, default=3)
+    parser.add_argument('--repeat', type=int, default=1, help='runs of every case, medians are reported')
+    parser.add_argument('--output', default=BENCH_DIR, help='dir for result json')
+    parser.add_argument('--compare', default=None, help='earlier result json to compare with')
+    parser.add_argument('--startup', action='store_true', help='measure startup and driver setup instead')
+    args = parser.parse_args(argv)
+    previous = load_results(args.compare) if args.compare else None
+    os.makedirs(args.output, exist_ok=True)
+    info = {'time': time.time(), 'python': sys.version.split()[0], 'platform': platform.platform(),
+            'cpus': os.cpu_count(), 'params': vars(args)}
+
+    if args.startup:
+        results = run_startup(repeat=args.repeat)
+        print_startup(results, previous=previous)
+        path = os.path.join(args.output, f'startup-{time.strftime("%Y%m%d-%H%M%S")}.json')
+        with open(file=path, mode='w', encoding='UTF-8') as file:
+            json.dump({**info, 'results': results}, file, indent=1)
+        print(f'Saved to {path}')
+        return 1 if any('error' in result for result in results) else 0
+
+    width, height = (int(side) for side in args.size.lower().split('x'))
+    server = standin.serve(results=args.images, width=width, height=height, delay=args.latency,
+                           fail_rate=args.fail_rate, page_delay=args.page_latency)
+    url_templates = standin.url_templates(server)
+    scheduling = {'rate': args.host_rate, 'burst': max(1, round(args.host_rate)), 'retries': args.retries}
+    cases = [{'backend': backend, 'engine': engine, 'workers': workers, 'images': args.images,
+              'thumbnails': args.thumbnails}
+             for backend in args.backends for engine in args.engines for workers in args.workers]
+
+    results = []
+    context = multiprocessing.get_context('spawn')  # fresh process, peak RSS of earlier cases does not leak in
+    try:
+        for case in cases:
+            runs = []
+            for _ in range(args.repeat):
+                download_root = tempfile.mkdtemp(prefix='bench-')
+                try:
+                    with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+                        runs.append(executor.submit(run_case, case, url_templates, download_root,
+                                                    scheduling).result())
+                finally:
+                    shutil.rmtree(download_root, ignore_errors=True)
+            results.append(_median_result(runs))
+            print(f'{case["backend"]} {case["engine"]} x{case["workers"]} done', file=sys.stderr)
+    finally:
+        server.shutdown()
+
+    print_table(results, previous=previous)
+    path = os.path.join(args.output, f'{time.strftime("%Y%m%d-%H%M%S")}.json')
+    with open(file=path, mode='w', encoding='UTF-8') as file:
+        json.dump({**info, 'results': results}, file, indent=1)
+    print(f'Saved to {path}')
+    return 1 if any('error' in result for result in results) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
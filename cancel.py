@@ -0,0 +1,68 @@
+#! /usr/bin/env python3
+import time
+import threading
+
+"""
+Cooperative cancellation and job deadlines. Scrape and download loops check token between steps,
+so request in flight finishes, browser is released as usual and job returns what it got so far
+"""
+
+
+class CancelToken:
+    """
+    Set by cancel() or when deadline passes. Has is_set(), set() and wait() of threading.Event,
+    so it can be passed where stop event is expected
+    """
+
+    def __init__(self, timeout: float = None):
+        """
+        :param timeout: seconds from now until token cancels itself, no deadline if None
+        """
+        self.deadline = time.monotonic() + timeout if timeout else None
+        self.reason = None
+        self._event = threading.Event()
+
+    def cancel(self, reason: str = 'cancelled') -> None:
+        """
+        Cancels job, first reason is kept
+
+        :param reason: why, e.g. 'stopped by user'
+        :return: None
+        """
+        if self.reason is None:
+            self.reason = reason
+        self._event.set()
+
+    set = cancel
+
+    @property
+    def cancelled(self) -> bool:
+        if not self._event.is_set() and self.deadline is not None and time.monotonic() >= self.deadline:
+            self.cancel(reason='deadline')
+        return self._event.is_set()
+
+    def is_set(self) -> bool:
+        return self.cancelled
+
+    def remaining(self) -> float or None:
+        """
+        Seconds until deadline
+
+        :return: seconds, 0 if token is cancelled, None if there is no deadline
+        """
+        if self.cancelled:
+            return 0.0
+        return None if self.deadline is None else max(0.0, self.deadline - time.monotonic())
+
+    def wait(self, timeout: float = None) -> bool:
+        """
+        Sleeps until token is cancelled, deadline passes or timeout expires
+
+        :param timeout: max seconds to wait
+        :return: True if token is cancelled
+        """
+        remaining = self.remaining()
+        if remaining is not None:
+            timeout = remaining if timeout is None else min(timeout, remaining)
+        self._event.wait(timeout)
+        return self.cancelled
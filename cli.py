@@ -0,0 +1,345 @@
+#! /usr/bin/env python3
+import os
+import sys
+import json
+import time
+import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import util
+from downloader import summarize, STATUS_OK, STATUS_FAILED, STATUS_SKIPPED
+from scrapper import create_scrapper, MULTI_ENGINE
+from engines import ENGINES
+from driver_pool import DriverPool
+from dedup_index import DedupIndex
+from manifest import JobManifest, JOBS_DIR
+from processing import ImageProcessor, FORMATS
+from filters import ImageFilter
+from hosts import HostScheduler
+from storage import LAYOUTS
+from metrics import METRICS, JsonFileSink, PrometheusSink
+from cancel import CancelToken
+import loggers
+from loggers import info_log, error_log
+
+"""
+Headless batch entry point: runs (engine, query, count) jobs in parallel processes
+
+Jobs file has one job per line, either 'engine,query,count' or json object
+{"engine": ..., "query": ..., "count": ...}. Empty lines and lines starting with # are ignored.
+
+Every job writes manifest to Jobs dir, interrupted jobs are continued with --resume.
+With --time-budget job stops after given seconds and keeps what it got, the rest can be resumed.
+
+Usage: python cli.py jobs.txt --backend http --concurrency 4 --output summary.jsonl
+       python cli.py --resume Jobs/*.jsonl
+"""
+
+_pool = None  # per process driver pool, browsers are reused by jobs of the same process
+_processor = None  # per process image processor, its worker processes are shared by jobs of the same process
+_image_filter = None
+_scheduler = None  # per process, so jobs of the same process share host limits
+
+
+def parse_jobs(lines) -> list:
+    """
+    Parses jobs file lines
+
+    :param lines: iterable of str
+    :return: list of dicts with engine, query and count
+    """
+    jobs = []
+    for line_number, line in enumerate(lines, start=1):
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        if line.startswith('{'):
+            job = json.loads(line)
+        else:
+            #  query itself may contain commas
+            engine, _, rest = line.partition(',')
+            query, _, count = rest.rpartition(',')
+            job = {'engine': engine.strip(), 'query': query.strip(), 'count': count.strip()}
+        valid_engine = job.get('engine') in ENGINES or job.get('engine') == MULTI_ENGINE
+        if not valid_engine or not job.get('query') or not str(job.get('count')).isdigit():
+            raise ValueError(f'Invalid job on line {line_number}: {line}')
+        job['count'] = int(job['count'])
+        jobs.append(job)
+    return jobs
+
+
+def _add_metrics_sinks(metrics_dir: str = None, metrics_port: int = None, tries: int = 1) -> None:
+    """
+    Exports metrics of current process to metrics_dir/metrics-<pid>.json and Prometheus endpoint
+
+    :param metrics_dir: dir for JSON files, no file if None
+    :param metrics_port: first port to try, processes of the pool take next free ones
+    :param tries: number of ports to try
+    :return: None
+    """
+    sinks = []
+    if metrics_dir:
+        os.makedirs(metrics_dir, exist_ok=True)
+        sinks.append(JsonFileSink(path=os.path.join(metrics_dir, f'metrics-{os.getpid()}.json')))
+    if metrics_port:
+        for port in range(metrics_port, metrics_port + tries):
+            try:
+                sinks.append(PrometheusSink(port=port))
+            except OSError:
+                continue  # taken by another job process
+            info_log.info(f'Metrics of process {os.getpid()} at http://127.0.0.1:{port}/metrics')
+            break
+    for sink in sinks:
+        METRICS.add_sink(sink)
+        util.Finalize(None, sink.close, exitpriority=5)
+
+
+def _init_process(backend: str, processing: dict = None, image_filter: ImageFilter = None,
+                  scheduling: dict = None, metrics: dict = None, log_queue=None) -> None:
+    """
+    Process pool initializer, creates driver pool for browser backend and image processor
+
+    :param backend: 'browser' or 'http'
+    :param processing: ImageProcessor() params
+    :param image_filter: ImageFilter() obj for all jobs
+    :param scheduling: HostScheduler() params
+    :param metrics: _add_metrics_sinks() params
+    :param log_queue: log records go to listener of main process through it
+    :return: None
+    """
+    global _pool, _processor, _image_filter, _scheduler
+    if log_queue is not None:
+        loggers.forward(log_queue)
+    _add_metrics_sinks(**(metrics or {}))
+    _image_filter = image_filter
+    _scheduler = HostScheduler(**(scheduling or {}))
+    if backend == 'browser':
+        _pool = DriverPool(size=len(ENGINES))
+        util.Finalize(None, _pool.close, exitpriority=10)
+    _processor = ImageProcessor(**(processing or {}))
+    util.Finalize(None, _processor.close, exitpriority=10)
+
+
+def _summarize(summary: dict, scrapper, path: str or None) -> None:
+    counts = summarize(scrapper.download_results)
+    ok_results = [result for result in scrapper.download_results if result.status == STATUS_OK]
+    left = sum(result.kind == 'cancelled' for result in scrapper.download_results)
+    summary.update({
+        'path': path,
+        'urls_found': scrapper.img_count,
+        'images_saved': counts[STATUS_OK],
+        'failed': counts[STATUS_FAILED],
+        'skipped': counts[STATUS_SKIPPED] - left,
+        'bytes': sum(result.size for result in ok_results),
+        'download_time_avg': round(sum(result.elapsed for result in ok_results) / len(ok_results), 4)
+        if ok_results else None,
+    })
+    if scrapper.cancelled:
+        summary.update({'cancelled': scrapper.cancel_token.reason, 'urls_left': left})
+
+
+def run_job(job: dict, backend: str = 'browser', workers: int = 8, download_dir: str = None,
+            index_path: str = None, manifest_dir: str = JOBS_DIR, layout: str = 'flat', shard_mb: int = 1024,
+            thumbnails: bool = False, time_budget: float = None) -> dict:
+    """
+    Scrapes and downloads images of single job
+
+    :param job: dict with engine, query and count
+    :param backend: 'browser' or 'http'
+    :param workers: download threads of the job
+    :param download_dir: root dir for downloads, default 'Download' dir
+    :param index_path: dedup index file, no dedup across runs if None
+    :param manifest_dir: where to write job manifest
+    :param layout: output layout, see storage.LAYOUTS
+    :param shard_mb: max size of tar or zip shard in MB
+    :param thumbnails: save thumbnails of result pages instead of full size images
+    :param time_budget: seconds job may run, it returns partial results when they pass. No limit if None
+    :return: job summary
+    """
+    summary = {'engine': job['engine'], 'query': job['query'], 'requested': job['count'], 'backend': backend}
+    start = time.perf_counter()
+    cancel_token = CancelToken(timeout=time_budget)  # budget counts from job start, browser wait included
+    index = None
+    try:
+        kwargs = {'pool': _pool} if _pool else {}
+        scrapper = create_scrapper(backend=backend, search_engine=job['engine'], **kwargs)
+        if download_dir:
+            scrapper.download_root = download_dir
+        if index_path:
+            index = scrapper.index = DedupIndex(path=index_path)
+        scrapper.processor = _processor
+        scrapper.image_filter = _image_filter
+        scrapper.scheduler = _scheduler
+        scrapper.layout = layout
+        scrapper.shard_bytes = shard_mb * 1024 ** 2
+        scrapper.cancel_token = cancel_token
+        manifest = JobManifest.create(jobs_dir=manifest_dir)
+        loggers.set_job_id(manifest.job_id)
+        summary['manifest'] = manifest.path
+        summary['setup_time'] = round(time.perf_counter() - start, 4)
+        options = {'thumbnails': True} if thumbnails else {}
+        path = scrapper.scrape_and_download(search_engine=job['engine'], query=job['query'],
+                                            max_urls=job['count'], workers=workers, manifest=manifest, **options)
+        _summarize(summary, scrapper=scrapper, path=path)
+    except Exception as err:
+        error_log.exception(f'Job {job} failed - {err}\n')
+        summary['error'] = str(err)
+    finally:
+        if index:
+            index.close()
+        loggers.set_job_id(None)
+    summary['total_time'] = round(time.perf_counter() - start, 4)
+    return summary
+
+
+def resume_job(manifest_path: str, backend: str = 'browser', workers: int = 8, index_path: str = None,
+               layout: str = 'flat', shard_mb: int = 1024, time_budget: float = None) -> dict:
+    """
+    Continues interrupted job from its manifest
+
+    :param manifest_path: manifest file written by run_job
+    :param backend: 'browser' or 'http'
+    :param workers: download threads of the job
+    :param index_path: dedup index file, no dedup across runs if None
+    :param layout: output layout, see storage.LAYOUTS
+    :param shard_mb: max size of tar or zip shard in MB
+    :param time_budget: seconds job may run, it returns partial results when they pass. No limit if None
+    :return: job summary
+    """
+    summary = {'manifest': manifest_path, 'backend': backend}
+    start = time.perf_counter()
+    cancel_token = CancelToken(timeout=time_budget)  # budget counts from job start, browser wait included
+    index = None
+    try:
+        manifest = JobManifest(path=manifest_path)
+        loggers.set_job_id(manifest.job_id)
+        if manifest.job is None:
+            raise ValueError(f'Manifest {manifest_path} has no job record')
+        summary.update({'engine': manifest.job['engine'], 'query': manifest.job['query'],
+                        'requested': manifest.job['max_urls'], 'already_saved': manifest.completed()})
+        if manifest.done:
+            summary.update({'path': manifest.job['output'], 'total_time': 0})
+            return summary
+        kwargs = {'pool': _pool} if _pool else {}
+        scrapper = create_scrapper(backend=backend, search_engine=manifest.job['engine'], **kwargs)
+        if index_path:
+            index = scrapper.index = DedupIndex(path=index_path)
+        scrapper.processor = _processor
+        scrapper.image_filter = _image_filter
+        scrapper.scheduler = _scheduler
+        scrapper.layout = layout
+        scrapper.shard_bytes = shard_mb * 1024 ** 2
+        scrapper.cancel_token = cancel_token
+        path = scrapper.resume(manifest=manifest, workers=workers)
+        _summarize(summary, scrapper=scrapper, path=path)
+    except Exception as err:
+        error_log.exception(f'Resume of {manifest_path} failed - {err}\n')
+        summary['error'] = str(err)
+    finally:
+        if index:
+            index.close()
+        loggers.set_job_id(None)
+    summary['total_time'] = round(time.perf_counter() - start, 4)
+    return summary
+
+
+def main(argv: list = None) -> int:
+    parser = argparse.ArgumentParser(description='Scrape and download images for batch of queries')
+    parser.add_argument('jobs', nargs='?', help='jobs file, "-" for stdin')
+    parser.add_argument('--resume', nargs='+', default=[], metavar='MANIFEST',
+                        help='continue interrupted jobs from their manifests')
+    parser.add_argument('--manifest-dir', default=JOBS_DIR, help='where to write job manifests')
+    parser.add_argument('--backend', choices=['browser', 'http'], default='browser')
+    parser.add_argument('--concurrency', type=int, default=2, help='jobs running at the same time')
+    parser.add_argument('--workers', type=int, default=8, help='download threads per job')
+    parser.add_argument('--time-budget', type=float, default=None, metavar='SECONDS',
+                        help='stop job after this time and keep partial results, resumable from manifest')
+    parser.add_argument('--download-dir', default=None, help='root dir for downloads')
+    parser.add_argument('--thumbnails', action='store_true',
+                        help='save thumbnails of result pages in bulk instead of opening every full size image')
+    parser.add_argument('--index', default=None,
+                        help='sqlite dedup index, skips urls and images downloaded by earlier runs')
+    parser.add_argument('--output', default='-', help='summary jsonl file, "-" for stdout')
+    parser.add_argument('--format', default='JPEG', choices=list(FORMATS), type=str.upper,
+                        help='saved image format')
+    parser.add_argument('--quality', type=int, default=85, help='JPEG and WEBP quality')
+    parser.add_argument('--max-size', type=int, default=None, help='resize images to this longest side in px')
+    parser.add_argument('--no-passthrough', action='store_true',
+                        help='re-encode images which are already in output format')
+    parser.add_argument('--processes', type=int, default=None,
+                        help='image processing processes per job process, by default cpu count is shared by jobs')
+    parser.add_argument('--layout', choices=LAYOUTS, default='flat',
+                        help='hash named files, files in hash prefix subdirs or tar/zip shards with index.jsonl')
+    parser.add_argument('--shard-mb', type=int, default=1024, help='max size of tar or zip shard')
+    parser.add_argument('--metrics-dir', default=None, help='writes metrics-<pid>.json of every job process')
+    parser.add_argument('--metrics-port', type=int, default=None,
+                        help='serves Prometheus metrics, job processes take this and next ports')
+    parser.add_argument('--log-dir', default=loggers.LOG_DIR, help='dir for rotated info and error logs')
+    parser.add_argument('--log-max-mb', type=int, default=loggers.MAX_BYTES // 1024 ** 2,
+                        help='log size which rotates it')
+    parser.add_argument('--log-rotate', default=None, metavar='WHEN',
+                        help='rotate logs by time instead, e.g. midnight or H')
+    parser.add_argument('--log-backups', type=int, default=loggers.BACKUPS, help='rotated logs to keep')
+    parser.add_argument('--log-json', action='store_true', help='write logs as JSON lines with job ids')
+    parser.add_argument('--host-rate', type=float, default=10, help='requests per second per image host')
+    parser.add_argument('--per-host', type=int, default=4, help='parallel downloads per image host')
+    parser.add_argument('--retries', type=int, default=3, help='retries of timeouts, 429 and 5xx responses')
+    filtering = parser.add_argument_group('filters', 'checked with Range requests before full download')
+    for name in ('min-width', 'max-width', 'min-height', 'max-height', 'min-bytes', 'max-bytes'):
+        filtering.add_argument(f'--{name}', type=int, default=None)
+    filtering.add_argument('--min-aspect', type=float, default=None, help='min width / height')
+    filtering.add_argument('--max-aspect', type=float, default=None, help='max width / height')
+    filtering.add_argument('--formats', type=lambda value: value.split(','), default=None,
+                           help='allowed formats, e.g. jpeg,png')
+    args = parser.parse_args(argv)
+    if not args.jobs and not args.resume:
+        parser.error('jobs file or --resume is required')
+
+    #  job processes send records to main process, so log files have single writer
+    log_queue = loggers.configure(log_dir=args.log_dir, max_bytes=args.log_max_mb * 1024 ** 2,
+                                  backups=args.log_backups, when=args.log_rotate, json_format=args.log_json,
+                                  log_queue=multiprocessing.Queue())
+    jobs = []
+    if args.jobs == '-':
+        jobs = parse_jobs(sys.stdin)
+    elif args.jobs:
+        with open(file=args.jobs, mode='r', encoding='UTF-8') as file:
+            jobs = parse_jobs(file)
+    info_log.info(f'Running {len(jobs)} jobs and resuming {len(args.resume)}, {args.concurrency} at a time')
+
+    processing = {'output_format': args.format, 'quality': args.quality, 'max_size': args.max_size,
+                  'passthrough': not args.no_passthrough,
+                  'processes': args.processes if args.processes is not None
+                  else max(1, (os.cpu_count() or 1) // args.concurrency)}
+    limits = {name: getattr(args, name) for name in ('min_width', 'max_width', 'min_height', 'max_height',
+                                                     'min_aspect', 'max_aspect', 'formats', 'min_bytes', 'max_bytes')}
+    image_filter = ImageFilter(**limits) if any(value is not None for value in limits.values()) else None
+    scheduling = {'rate': args.host_rate, 'burst': max(1, round(args.host_rate)), 'max_per_host': args.per_host,
+                  'retries': args.retries}
+    metrics = {'metrics_dir': args.metrics_dir, 'metrics_port': args.metrics_port, 'tries': args.concurrency * 2}
+    output = sys.stdout if args.output == '-' else open(file=args.output, mode='a', encoding='UTF-8')
+    failed = 0
+    try:
+        with ProcessPoolExecutor(max_workers=args.concurrency, initializer=_init_process,
+                                 initargs=(args.backend, processing, image_filter, scheduling, metrics,
+                                           log_queue)) as executor:
+            futures = [executor.submit(run_job, job, args.backend, args.workers, args.download_dir, args.index,
+                                       args.manifest_dir, args.layout, args.shard_mb, args.thumbnails,
+                                       args.time_budget)
+                       for job in jobs]
+            futures += [executor.submit(resume_job, path, args.backend, args.workers, args.index, args.layout,
+                                        args.shard_mb, args.time_budget)
+                        for path in args.resume]
+            for future in as_completed(futures):
+                summary = future.result()
+                failed += 'error' in summary
+                output.write(json.dumps(summary, ensure_ascii=False) + '\n')
+                output.flush()
+    finally:
+        if output is not sys.stdout:
+            output.close()
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
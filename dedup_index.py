@@ -0,0 +1,167 @@
+#! /usr/bin/env python3
+import os
+import time
+import sqlite3
+import hashlib
+import threading
+from PIL import Image
+from urls import url_key, url_digest
+
+"""
+Persistent dedup index shared by runs: exact content hashes, perceptual hashes and downloaded urls
+"""
+
+INDEX_PATH = os.path.join(os.path.dirname(__file__), 'index.sqlite')
+BANDS = 4  # perceptual hash is split in 4 x 16 bit bands for lookup
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS content (sha256 TEXT PRIMARY KEY, path TEXT, url TEXT, added REAL);
+CREATE TABLE IF NOT EXISTS phash (hash INTEGER, band0 INTEGER, band1 INTEGER, band2 INTEGER, band3 INTEGER,
+                                  path TEXT);
+CREATE INDEX IF NOT EXISTS phash_band0 ON phash (band0);
+CREATE INDEX IF NOT EXISTS phash_band1 ON phash (band1);
+CREATE INDEX IF NOT EXISTS phash_band2 ON phash (band2);
+CREATE INDEX IF NOT EXISTS phash_band3 ON phash (band3);
+CREATE TABLE IF NOT EXISTS url (key BLOB PRIMARY KEY, added REAL);
+'''
+
+
+def content_hash(data: bytes) -> str:
+    """
+    Exact content hash
+
+    :param data: file content
+    :return: sha256 hex digest
+    """
+    return hashlib.sha256(data).hexdigest()
+
+
+def perceptual_hash(image: Image.Image) -> int:
+    """
+    64 bit difference hash: compares neighbour pixels of 9x8 grayscale thumbnail,
+    so resized or recompressed copies get the same or close hash
+
+    :param image: PIL.Image obj
+    :return: unsigned 64 bit int
+    """
+    pixels = list(image.convert('L').resize((9, 8), Image.BILINEAR).getdata())
+    value = 0
+    for row in range(8):
+        for col in range(8):
+            value = (value << 1) | (pixels[row * 9 + col] > pixels[row * 9 + col + 1])
+    return value
+
+
+def _signed(value: int) -> int:
+    #  sqlite INTEGER is signed 64 bit
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+
+def _bands(value: int) -> list:
+    return [(value >> (16 * band)) & 0xFFFF for band in range(BANDS)]
+
+
+class DedupIndex:
+    """
+    SQLite index of downloaded images. Safe to share between threads, several processes may open the same file.
+    Near duplicates are found by perceptual hash within max_distance bits, at most 3 bits
+    guarantee that one of 4 bands matches exactly
+    """
+
+    def __init__(self, path: str = INDEX_PATH, max_distance: int = 3):
+        self.path = path
+        self.max_distance = max_distance
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.executescript(_SCHEMA)
+
+    def has_url(self, url: str) -> bool:
+        """
+        Checks if url was downloaded by earlier run
+
+        :param url: normalized url
+        :return: bool
+        """
+        with self._lock:
+            row = self._conn.execute('SELECT 1 FROM url WHERE key = ?', (url_digest(url_key(url)),)).fetchone()
+        return row is not None
+
+    def add_url(self, url: str) -> None:
+        """
+        Marks url as downloaded
+
+        :param url: normalized url
+        :return: None
+        """
+        with self._lock:
+            self._conn.execute('INSERT OR IGNORE INTO url VALUES (?, ?)', (url_digest(url_key(url)), time.time()))
+
+    def claim_content(self, sha256: str, url: str) -> bool:
+        """
+        Reserves content hash for url, so parallel downloads of the same file are saved once
+
+        :param sha256: content hash
+        :param url: image url
+        :return: False if content is already stored or claimed
+        """
+        with self._lock:
+            cursor = self._conn.execute('INSERT OR IGNORE INTO content VALUES (?, NULL, ?, ?)',
+                                        (sha256, url, time.time()))
+        return cursor.rowcount == 1
+
+    def release_content(self, sha256: str) -> None:
+        """
+        Drops claim of content which failed to save
+
+        :param sha256: content hash
+        :return: None
+        """
+        with self._lock:
+            self._conn.execute('DELETE FROM content WHERE sha256 = ? AND path IS NULL', (sha256,))
+
+    def content_path(self, sha256: str) -> str or None:
+        """
+        Where content with given hash was saved
+
+        :param sha256: content hash
+        :return: path or None
+        """
+        with self._lock:
+            row = self._conn.execute('SELECT path FROM content WHERE sha256 = ?', (sha256,)).fetchone()
+        return row[0] if row else None
+
+    def find_similar(self, phash: int) -> str or None:
+        """
+        Looks for stored image with perceptual hash within max_distance bits
+
+        :param phash: perceptual_hash() value
+        :return: path of similar image or None
+        """
+        bands = _bands(phash)
+        query = 'SELECT hash, path FROM phash WHERE ' + ' OR '.join(f'band{band} = ?' for band in range(BANDS))
+        with self._lock:
+            rows = self._conn.execute(query, bands).fetchall()
+        for stored, path in rows:
+            if bin((stored & 0xFFFFFFFFFFFFFFFF) ^ phash).count('1') <= self.max_distance:
+                return path
+        return None
+
+    def add_image(self, sha256: str, phash: int, path: str, url: str) -> None:
+        """
+        Stores saved image
+
+        :param sha256: content hash
+        :param phash: perceptual_hash() value
+        :param path: saved file path
+        :param url: image url
+        :return: None
+        """
+        with self._lock:
+            self._conn.execute('INSERT OR REPLACE INTO content VALUES (?, ?, ?, ?)', (sha256, path, url, time.time()))
+            self._conn.execute('INSERT INTO phash VALUES (?, ?, ?, ?, ?, ?)', (_signed(phash), *_bands(phash), path))
+            self._conn.execute('INSERT OR IGNORE INTO url VALUES (?, ?)', (url_digest(url_key(url)), time.time()))
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
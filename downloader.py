@@ -0,0 +1,384 @@
+#! /usr/bin/env python3
+import os
+import base64
+import hashlib
+import uuid
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from requests.adapters import HTTPAdapter
+from loggers import info_log, error_log
+from dedup_index import DedupIndex
+from processing import ImageProcessor
+from filters import ImageFilter, probe
+from hosts import HostScheduler, HostUnavailable
+from storage import make_storage, SHARD_BYTES
+from metrics import METRICS
+from urls import is_data_uri, short_url
+
+"""
+Concurrent image download engine
+"""
+
+USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 ' \
+             '(KHTML, like Gecko) ' \
+             'Chrome/83.0.4103.53 Safari/537.36'
+
+STATUS_OK = 'ok'
+STATUS_FAILED = 'failed'
+STATUS_SKIPPED = 'skipped'
+
+CHUNK_SIZE = 64 * 1024
+MAX_BYTES = 50 * 1024 * 1024  # default cap of single image
+
+
+class DownloadTooLarge(Exception):
+    """
+    Response body is over max_bytes, download is aborted
+    """
+
+
+def _error_kind(err: Exception) -> str:
+    response = getattr(err, 'response', None)
+    return f'http_{response.status_code}' if response is not None else type(err).__name__
+
+
+class DownloadResult:
+    """
+    Outcome of a single url download
+    """
+
+    def __init__(self, url: str, status: str, path: str = None, reason: str = None,
+                 size: int = 0, elapsed: float = 0.0, kind: str = None):
+        self.url = url
+        self.status = status
+        self.path = path
+        self.reason = reason
+        self.kind = kind  # short reason for metrics, e.g. filtered or http_404
+        self.size = size
+        self.elapsed = elapsed
+
+    def __repr__(self):
+        return f'DownloadResult({self.status!r}, {self.url!r}, reason={self.reason!r})'
+
+    def to_dict(self) -> dict:
+        """
+        Plain dict representation for summaries
+
+        :return: dict
+        """
+        return {'url': self.url, 'status': self.status, 'path': self.path, 'reason': self.reason,
+                'size': self.size, 'elapsed': round(self.elapsed, 4)}
+
+
+class Downloader:
+    """
+    Downloads images concurrently with pooled keep-alive connections.
+    Every worker thread owns a requests.Session, which keeps a connection pool per host
+    """
+
+    def __init__(self, workers: int = 8, connect_timeout: float = 5, read_timeout: float = 20,
+                 index: DedupIndex = None, processor: ImageProcessor = None, image_filter: ImageFilter = None,
+                 max_bytes: int = MAX_BYTES, scheduler: HostScheduler = None, layout: str = 'flat',
+                 shard_bytes: int = SHARD_BYTES, cancel_token=None):
+        """
+        :param workers: number of download threads
+        :param connect_timeout: seconds to wait for connection
+        :param read_timeout: seconds to wait for server response
+        :param index: DedupIndex() obj to skip images stored by this or earlier runs
+        :param processor: ImageProcessor() obj with output settings, JPEG pass-through if None.
+        Caller owns given processor, own one is closed by close()
+        :param image_filter: ImageFilter() obj, rejected images are not downloaded
+        :param max_bytes: download is aborted when body gets bigger, no limit if None.
+        Filter max_bytes lowers it
+        :param scheduler: HostScheduler() obj with per-host limits and retries, default limits if None
+        :param layout: output layout, see storage.LAYOUTS
+        :param shard_bytes: max size of tar or zip shard
+        :param cancel_token: CancelToken() obj, urls not started before it is cancelled are skipped
+        """
+        self.workers = workers
+        self.index = index
+        self.image_filter = image_filter
+        limits = [limit for limit in (max_bytes, image_filter and image_filter.max_bytes) if limit]
+        self.max_bytes = min(limits) if limits else None
+        self.scheduler = scheduler or HostScheduler()
+        self._own_processor = processor is None
+        self.processor = processor or ImageProcessor()
+        self.timeout = (connect_timeout, read_timeout)
+        self._local = threading.local()
+        self._sessions = []
+        self._sessions_lock = threading.Lock()
+        self.layout = layout
+        self.shard_bytes = shard_bytes
+        self._storages = {}  # output dir -> storage
+        self._storages_lock = threading.Lock()
+        self.cancel_token = cancel_token
+
+    def session(self) -> requests.Session:
+        """
+        Returns session of the current worker thread, creates it on first use
+
+        :return: requests.Session() obj
+        """
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=self.workers, pool_maxsize=self.workers)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            session.headers['User-Agent'] = USER_AGENT
+            self._local.session = session
+            with self._sessions_lock:
+                self._sessions.append(session)
+        return session
+
+    def storage(self, dir_path: str):
+        """
+        Returns storage of output dir, creates it on first use
+
+        :param dir_path: output dir
+        :return: storage obj
+        """
+        with self._storages_lock:
+            if dir_path not in self._storages:
+                self._storages[dir_path] = make_storage(layout=self.layout, dir_path=dir_path,
+                                                        shard_bytes=self.shard_bytes)
+            return self._storages[dir_path]
+
+    def _fetch(self, url: str, part_path: str) -> tuple:
+        """
+        Streams response body to part file chunk by chunk, so memory per download does not depend on file size
+
+        :param url: image url
+        :param part_path: where to write body
+        :return: (body size, sha256 hex digest)
+        """
+        with self.session().get(url=url, timeout=self.timeout, stream=True) as response:
+            response.raise_for_status()
+            length = response.headers.get('Content-Length', '')
+            if self.max_bytes and length.isdigit() and int(length) > self.max_bytes:
+                raise DownloadTooLarge(f'Content-Length {length} is more than {self.max_bytes} bytes')
+            sha256 = hashlib.sha256()
+            size = 0
+            with open(file=part_path, mode='wb') as file:
+                for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+                    size += len(chunk)
+                    #  Content-Length may be missing or wrong
+                    if self.max_bytes and size > self.max_bytes:
+                        raise DownloadTooLarge(f'body is more than {self.max_bytes} bytes')
+                    sha256.update(chunk)
+                    file.write(chunk)
+        return size, sha256.hexdigest()
+
+    def _decode(self, url: str, part_path: str) -> tuple:
+        """
+        Writes image embedded in data URI to part file, nothing is downloaded
+
+        :param url: base64 data URI
+        :param part_path: where to write image
+        :return: (image size, sha256 hex digest)
+        """
+        body = base64.b64decode(url.partition(',')[2])
+        if self.max_bytes and len(body) > self.max_bytes:
+            raise DownloadTooLarge(f'data URI is more than {self.max_bytes} bytes')
+        with open(file=part_path, mode='wb') as file:
+            file.write(body)
+        return len(body), hashlib.sha256(body).hexdigest()
+
+    def download_one(self, url: str, dir_path: str) -> DownloadResult:
+        """
+        Downloads single image and records its outcome in metrics
+
+        :param url: image url
+        :param dir_path: where to save
+        :return: DownloadResult() obj
+        """
+        if self.cancel_token is not None and self.cancel_token.cancelled:
+            #  download in flight finishes, the rest is not started
+            return DownloadResult(url=url, status=STATUS_SKIPPED, reason=self.cancel_token.reason, kind='cancelled')
+        result = self._download_one(url=url, dir_path=dir_path)
+        METRICS.inc('downloads_total', status=result.status, kind=result.kind or 'ok')
+        METRICS.observe('download_seconds', result.elapsed, status=result.status)
+        METRICS.inc('download_bytes_total', result.size)
+        return result
+
+    def _download_one(self, url: str, dir_path: str) -> DownloadResult:
+        """
+        Downloads single image and saves it in processor output format.
+        Body is streamed to part file in dir_path, then part file or its converted copy goes to storage
+        under sha256 of downloaded content. Image of data URI is decoded instead of download
+
+        :param url: image url
+        :param dir_path: where to save
+        :return: DownloadResult() obj
+        """
+        embedded = is_data_uri(url)
+        if not embedded and not url.startswith(('http://', 'https://')):
+            return DownloadResult(url=url, status=STATUS_SKIPPED, reason='unsupported scheme',
+                                  kind='unsupported_scheme')
+        start = time.perf_counter()
+        sha256 = None
+        size = 0
+        part_path = os.path.join(dir_path, f'.{uuid.uuid4().hex}.part')
+        converted_path = None
+        try:
+            #  cheap probe first, so rejected image is not downloaded
+            if self.image_filter and not embedded:
+                with METRICS.timer('probe_seconds'):
+                    info = self.scheduler.call(url, lambda: probe(self.session(), url=url, timeout=self.timeout,
+                                                                  probe_bytes=self.image_filter.probe_bytes,
+                                                                  header=self.image_filter.needs_header),
+                                               cancel_token=self.cancel_token)
+                reason = self.image_filter.check(info)
+                if reason:
+                    return DownloadResult(url=url, status=STATUS_SKIPPED, reason=f'filtered: {reason}',
+                                          elapsed=time.perf_counter() - start, kind='filtered')
+
+            if embedded:
+                size, digest = self._decode(url=url, part_path=part_path)
+            else:
+                size, digest = self.scheduler.call(url, lambda: self._fetch(url=url, part_path=part_path),
+                                                   cancel_token=self.cancel_token)
+            if self.image_filter:
+                reason = self.image_filter.check_file(part_path)
+                if reason:
+                    return DownloadResult(url=url, status=STATUS_SKIPPED, reason=f'filtered: {reason}',
+                                          size=size, elapsed=time.perf_counter() - start, kind='filtered')
+
+            #  exact duplicate is skipped before decode
+            if self.index:
+                if not self.index.claim_content(sha256=digest, url=url):
+                    self.index.add_url(url)
+                    return DownloadResult(url=url, status=STATUS_SKIPPED, reason='duplicate content',
+                                          size=size, elapsed=time.perf_counter() - start, kind='duplicate')
+                sha256 = digest
+
+            #  decode and encode run in processor worker, download thread only waits
+            converted_path, extension, phash = self.processor.process(path=part_path,
+                                                                      with_phash=self.index is not None)
+
+            #  near duplicate is skipped before write
+            if self.index:
+                similar_path = self.index.find_similar(phash)
+                if similar_path:
+                    self.index.add_url(url)
+                    return DownloadResult(url=url, status=STATUS_SKIPPED, reason=f'similar to {similar_path}',
+                                          size=size, elapsed=time.perf_counter() - start, kind='similar')
+
+            file_path = self.storage(dir_path).store(src_path=converted_path or part_path, sha256=digest,
+                                                     extension=extension, url=url)
+            if self.index:
+                self.index.add_image(sha256=sha256, phash=phash, path=file_path, url=url)
+                sha256 = None
+        except DownloadTooLarge as err:
+            return DownloadResult(url=url, status=STATUS_SKIPPED, reason=str(err), size=size,
+                                  elapsed=time.perf_counter() - start, kind='too_large')
+        except HostUnavailable as err:
+            error_log.error(f'ERROR downloading {short_url(url)} - {err}\n')
+            return DownloadResult(url=url, status=STATUS_FAILED, reason=str(err),
+                                  elapsed=time.perf_counter() - start, kind='host_unavailable')
+        except Exception as err:
+            error_log.exception(f'ERROR downloading {short_url(url)} - {err}\n')
+            return DownloadResult(url=url, status=STATUS_FAILED, reason=str(err),
+                                  elapsed=time.perf_counter() - start, kind=_error_kind(err))
+        finally:
+            if sha256:
+                #  content was claimed, but image was not saved
+                self.index.release_content(sha256)
+            for path in (part_path, converted_path):
+                if path and os.path.exists(path):
+                    os.remove(path)
+        return DownloadResult(url=url, status=STATUS_OK, path=file_path, size=size,
+                              elapsed=time.perf_counter() - start)
+
+    def download(self, urls, dir_path: str) -> list:
+        """
+        Downloads images from urls using worker pool
+
+        :param urls: iterable of image urls
+        :param dir_path: where to save
+        :return: list of DownloadResult() obj, one per url
+        """
+        results = []
+        seen = set()
+        unique_urls = []
+        for url in urls:
+            if url in seen:
+                results.append(DownloadResult(url=url, status=STATUS_SKIPPED, reason='duplicate'))
+            else:
+                seen.add(url)
+                unique_urls.append(url)
+
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='download') as executor:
+            results.extend(executor.map(lambda url: self.download_one(url=url, dir_path=dir_path), unique_urls))
+
+        counts = summarize(results)
+        info_log.info(f'Downloaded {counts[STATUS_OK]} images, '
+                      f'{counts[STATUS_FAILED]} failed, {counts[STATUS_SKIPPED]} skipped')
+        return results
+
+    def consume(self, url_queue, dir_path: str, on_result=None) -> list:
+        """
+        Downloads urls from queue while producer is still filling it.
+        Producer is expected to dedupe urls. Every worker stops on None sentinel, so producer must put one per worker.
+        After cancel workers keep draining queue, so producer never blocks
+
+        :param url_queue: queue.Queue() obj with image urls
+        :param dir_path: where to save
+        :param on_result: called from worker thread with every DownloadResult() obj, except urls skipped by cancel,
+            so manifest keeps them pending
+        :return: list of DownloadResult() obj, one per url
+        """
+        def worker() -> list:
+            worker_results = []
+            while True:
+                url = url_queue.get()
+                if url is None:
+                    return worker_results
+                result = self.download_one(url=url, dir_path=dir_path)
+                if on_result and result.kind != 'cancelled':
+                    on_result(result)
+                worker_results.append(result)
+
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='download') as executor:
+            futures = [executor.submit(worker) for _ in range(self.workers)]
+        results = [result for future in futures for result in future.result()]
+
+        counts = summarize(results)
+        info_log.info(f'Downloaded {counts[STATUS_OK]} images, '
+                      f'{counts[STATUS_FAILED]} failed, {counts[STATUS_SKIPPED]} skipped')
+        left = sum(result.kind == 'cancelled' for result in results)
+        if left:
+            info_log.info(f'Download stopped: {self.cancel_token.reason}, {left} urls left')
+        return results
+
+    def close(self) -> None:
+        """
+        Closes all worker sessions, storages and own processor
+
+        :return: None
+        """
+        with self._sessions_lock:
+            for session in self._sessions:
+                session.close()
+            self._sessions.clear()
+        with self._storages_lock:
+            for storage in self._storages.values():
+                storage.close()
+            self._storages.clear()
+        if self._own_processor:
+            self.processor.close()
+
+
+def summarize(results) -> dict:
+    """
+    Counts results by status
+
+    :param results: iterable of DownloadResult() obj
+    :return: dict status -> count
+    """
+    counts = {STATUS_OK: 0, STATUS_FAILED: 0, STATUS_SKIPPED: 0}
+    for result in results:
+        counts[result.status] += 1
+    return counts
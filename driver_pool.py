@@ -0,0 +1,273 @@
+#! /usr/bin/env python3
+import os
+import json
+import time
+import queue
+import threading
+from contextlib import contextmanager
+from loggers import info_log, error_log
+from metrics import METRICS
+
+"""
+Pool of warm headless Chrome sessions shared between queries.
+
+selenium and webdriver_manager are imported on first browser start. Resolved chromedriver path and browser version
+are cached in driver_cache.json, so version discovery runs again only when cache gets old, driver file is gone
+or browser was updated
+"""
+
+#  runs before page scripts on every navigation
+STEALTH_SCRIPT = 'Object.defineProperty(navigator, "webdriver", {get: () => undefined})'
+DRIVER_CACHE = os.path.join(os.path.dirname(__file__), 'driver_cache.json')
+DRIVER_CACHE_AGE = 7 * 24 * 3600  # seconds, then newer driver is looked up
+
+_driver_path = None  # resolved in this process
+_driver_lock = threading.Lock()
+
+
+def _read_driver_cache(cache_path: str) -> dict or None:
+    """
+    Cached resolution if it is still valid
+
+    :param cache_path: cache file
+    :return: dict with path, browser_version and resolved time or None
+    """
+    try:
+        with open(file=cache_path, mode='r', encoding='UTF-8') as file:
+            record = json.load(file)
+        fresh = time.time() - record['resolved'] < DRIVER_CACHE_AGE
+        return record if fresh and os.access(record['path'], os.X_OK) else None
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+
+
+def _write_driver_cache(cache_path: str, record: dict) -> None:
+    try:
+        temp_path = f'{cache_path}.{os.getpid()}.tmp'
+        with open(file=temp_path, mode='w', encoding='UTF-8') as file:
+            json.dump(record, file)
+        os.replace(temp_path, cache_path)  # processes starting browsers at once never read half written file
+    except OSError as err:
+        error_log.error(f'Can not write driver cache {cache_path} - {err}\n')
+
+
+def forget_driver(cache_path: str = DRIVER_CACHE) -> None:
+    """
+    Drops cached chromedriver, next driver_path() resolves it again
+
+    :param cache_path: cache file
+    :return: None
+    """
+    global _driver_path
+    with _driver_lock:
+        _driver_path = None
+        if os.path.exists(cache_path):
+            os.remove(cache_path)
+
+
+def driver_path(cache_path: str = DRIVER_CACHE) -> str:
+    """
+    Resolves chromedriver once per process, from disk cache if it is valid
+
+    :param cache_path: cache file
+    :return: path to chromedriver executable
+    """
+    global _driver_path
+    with _driver_lock:
+        if _driver_path is None:
+            record = _read_driver_cache(cache_path)
+            if record is None:
+                from webdriver_manager.chrome import ChromeDriverManager
+                start = time.perf_counter()
+                manager = ChromeDriverManager()
+                record = {'path': manager.install(), 'browser_version': manager.driver.browser_version,
+                          'resolved': time.time()}
+                METRICS.observe('driver_resolve_seconds', time.perf_counter() - start)
+                _write_driver_cache(cache_path, record)
+                info_log.info(f'Resolved chromedriver {record["path"]} for browser {record["browser_version"]}')
+            _driver_path = record['path']
+        return _driver_path
+
+
+def _same_browser(driver, cache_path: str) -> bool:
+    """
+    Checks that started browser has major version chromedriver was resolved for
+    """
+    record = _read_driver_cache(cache_path)
+    version = driver.capabilities.get('browserVersion') or driver.capabilities.get('version') or ''
+    cached = str(record.get('browser_version') or '') if record else ''
+    return not cached or cached.split('.')[0] == version.split('.')[0]
+
+
+def create_driver(cache_path: str = DRIVER_CACHE):
+    """
+    Starts headless Chrome configured to look like regular browser.
+    Cached chromedriver which does not match browser any more is resolved again
+
+    :param cache_path: chromedriver cache file
+    :return: webdriver.Chrome() obj
+    """
+    from selenium import webdriver
+    from selenium.common.exceptions import SessionNotCreatedException
+    from downloader import USER_AGENT
+    start = time.perf_counter()
+    opts = webdriver.ChromeOptions()
+    opts.headless = True
+    opts.add_argument('start-maximized')
+    opts.add_argument('--disable-blink-features=AutomationControlled')
+    opts.add_argument('--incognito')
+    opts.add_experimental_option('excludeSwitches', ['enable-automation'])
+    opts.add_experimental_option('useAutomationExtension', False)
+    try:
+        driver = webdriver.Chrome(executable_path=driver_path(cache_path), options=opts)
+    except SessionNotCreatedException as err:
+        #  browser was updated and cached driver does not support it
+        error_log.error(f'Cached chromedriver does not fit browser, resolving it again - {err}\n')
+        forget_driver(cache_path)
+        driver = webdriver.Chrome(executable_path=driver_path(cache_path), options=opts)
+    if not _same_browser(driver, cache_path):
+        info_log.info('Browser was updated, chromedriver will be resolved again on next start')
+        forget_driver(cache_path)
+    driver.execute_cdp_cmd('Page.addScriptToEvaluateOnNewDocument', {'source': STEALTH_SCRIPT})
+    driver.execute_script(STEALTH_SCRIPT)
+    driver.execute_cdp_cmd('Network.setUserAgentOverride', {"userAgent": USER_AGENT})
+    METRICS.observe('browser_start_seconds', time.perf_counter() - start)
+    return driver
+
+
+class DriverPool:
+    """
+    Keeps up to size browsers alive between queries.
+    Browser is checked before it is handed out and recycled after max_uses queries or when it crashed
+    """
+
+    def __init__(self, size: int = 2, max_uses: int = 20, factory=create_driver):
+        self.size = size
+        self.max_uses = max_uses
+        self.factory = factory
+        self._idle = queue.LifoQueue()  # most recently used browser is the warmest
+        self._slots = threading.BoundedSemaphore(size)
+        self._uses = {}
+        self._lock = threading.Lock()
+        self._closed = False
+
+    @staticmethod
+    def is_healthy(driver) -> bool:
+        """
+        Checks that browser still responds
+
+        :param driver: webdriver obj
+        :return: bool
+        """
+        try:
+            return driver.execute_script('return 1;') == 1
+        except Exception:
+            return False
+
+    def _create(self):
+        driver = self.factory()
+        with self._lock:
+            self._uses[id(driver)] = 0
+        info_log.info(f'Started browser for pool ({len(self._uses)}/{self.size})')
+        return driver
+
+    def _discard(self, driver) -> None:
+        with self._lock:
+            self._uses.pop(id(driver), None)
+        try:
+            driver.quit()
+        except Exception as err:
+            error_log.error(f'Failed to quit browser - {err}\n')
+
+    def warm(self, count: int = None) -> None:
+        """
+        Starts browsers ahead of time so first queries do not wait for them
+
+        :param count: number of browsers, pool size by default
+        :return: None
+        """
+        for _ in range(min(count or self.size, self.size) - self._idle.qsize()):
+            self._idle.put(self._create())
+
+    def acquire(self, timeout: float = None):
+        """
+        Takes healthy browser from pool, starts new one if there is no idle browser.
+        Blocks while all browsers are busy
+
+        :param timeout: max seconds to wait for free browser, forever by default
+        :return: webdriver obj
+        """
+        if self._closed:
+            raise RuntimeError('Driver pool is closed')
+        if not self._slots.acquire(timeout=timeout):
+            raise TimeoutError(f'No free browser in {timeout} s')
+        try:
+            while True:
+                try:
+                    driver = self._idle.get_nowait()
+                except queue.Empty:
+                    return self._create()
+                if self.is_healthy(driver):
+                    return driver
+                info_log.info('Dropping crashed browser from pool')
+                self._discard(driver)
+        except BaseException:
+            self._slots.release()
+            raise
+
+    def release(self, driver, broken: bool = False) -> None:
+        """
+        Returns browser to pool, browser is quit if it is broken or used up
+
+        :param driver: webdriver obj taken by acquire()
+        :param broken: True if caller saw browser crash
+        :return: None
+        """
+        try:
+            with self._lock:
+                self._uses[id(driver)] = self._uses.get(id(driver), 0) + 1
+                used_up = self._uses[id(driver)] >= self.max_uses
+            if self._closed or broken or used_up or not self.is_healthy(driver):
+                self._discard(driver)
+                return
+            try:
+                driver.delete_all_cookies()
+                driver.get('about:blank')
+            except Exception as err:
+                error_log.error(f'Failed to reset browser - {err}\n')
+                self._discard(driver)
+                return
+            self._idle.put(driver)
+        finally:
+            self._slots.release()
+
+    @contextmanager
+    def borrow(self, timeout: float = None):
+        """
+        acquire() and release() as context manager
+
+        :param timeout: max seconds to wait for free browser
+        :return: webdriver obj
+        """
+        driver = self.acquire(timeout=timeout)
+        broken = False
+        try:
+            yield driver
+        except Exception:
+            broken = not self.is_healthy(driver)
+            raise
+        finally:
+            self.release(driver, broken=broken)
+
+    def close(self) -> None:
+        """
+        Quits idle browsers, browsers in use are quit when released
+
+        :return: None
+        """
+        self._closed = True
+        while True:
+            try:
+                self._discard(self._idle.get_nowait())
+            except queue.Empty:
+                break
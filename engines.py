@@ -0,0 +1,368 @@
+#! /usr/bin/env python3
+import re
+import html
+import json
+from urllib.parse import quote_plus
+from loggers import info_log, error_log
+import page_scripts
+
+"""
+Search engine plugins and registry. Scrappers and GUI read engines from ENGINES,
+new engine is a SearchEngine subclass decorated with @register_engine
+"""
+
+ENGINES = {}
+MULTI_ENGINE = 'All engines'  # fan-out search over every registered engine
+
+
+def register_engine(engine_class):
+    """
+    Class decorator, adds engine instance to registry under its name
+
+    :param engine_class: SearchEngine subclass
+    :return: engine_class
+    """
+    ENGINES[engine_class.name] = engine_class()
+    return engine_class
+
+
+def get_engine(name: str):
+    """
+    Registered engine by name
+
+    :param name: engine name, e.g. Google
+    :return: SearchEngine() obj
+    """
+    try:
+        return ENGINES[name]
+    except KeyError:
+        raise ValueError(f'No such search engine {name}') from None
+
+
+#  base64 images embedded in page, e.g. first rows of thumbnails. Gif is lazy load placeholder
+_DATA_URI_RE = re.compile(r'data:image/(?:jpeg|png|webp);base64,[A-Za-z0-9+/]+=*')
+
+
+def _data_uris(text: str) -> list:
+    """
+    Finds base64 images in page html and scripts, where = may be escaped as \\x3d or \\u003d
+    """
+    text = text.replace('\\x3d', '=').replace('\\u003d', '=').replace('\\/', '/')
+    return _DATA_URI_RE.findall(text)
+
+
+def _json_string(raw: str) -> str:
+    """
+    Decodes escapes of string taken from embedded json, e.g. \\u003d
+    """
+    try:
+        return json.loads(f'"{raw}"')
+    except ValueError:
+        return raw
+
+
+class SearchEngine:
+    """
+    Search engine plugin: url template, extraction strategy for browser and http backends and tunables.
+    Tunables are defaults, callers may override them per job
+    """
+    name = None
+    url_template = None  # result page url, {q} is replaced by query
+    page_param = ''  # appended to url_template by http backend, {page} is replaced by page number
+    thumbnail_selector = None  # result thumbnail img, read by thumbnail harvest in browser
+    thumbnail_re = None  # thumbnail urls in result page html, read by thumbnail harvest of http backend
+
+    #  tunables
+    sleep = 2  # max wait between browser interactions
+    patience = 3  # interactions without new results before giving up
+    batch_size = 20  # images handled per webdriver round trip in batch extraction
+    max_pages = 50  # result pages requested by http backend
+    workers = 8  # download threads
+
+    def search_url(self, query: str, template: str = None) -> str:
+        """
+        Result page url for browser
+
+        :param query: what to search
+        :param template: overrides url_template
+        :return: url
+        """
+        return (template or self.url_template).format(q=query)
+
+    def page_url(self, query: str, page: int, template: str = None) -> str:
+        """
+        Result page url for http backend
+
+        :param query: what to search
+        :param page: page number starting from 0
+        :param template: overrides url_template, e.g. to use local server
+        :return: url
+        """
+        return (template or self.url_template).format(q=quote_plus(query)) + self.page_param.format(page=page)
+
+    def browser_urls(self, scrapper, sleep: float, patience: int, extraction: str, batch_size: int):
+        """
+        Yields raw full size image urls from result page opened in scrapper.webdriver
+
+        :param scrapper: ImageScrapper() obj
+        :param sleep: max wait between interactions
+        :param patience: interactions without new results before giving up
+        :param extraction: 'batch' or 'element'
+        :param batch_size: images handled per round trip in batch extraction
+        :return: generator of urls
+        """
+        raise NotImplementedError
+
+    def parse_page(self, text: str) -> list:
+        """
+        Parses full size image urls from result page html for http backend
+
+        :param text: page html
+        :return: list of urls
+        """
+        raise NotImplementedError
+
+    def browser_thumbnails(self, scrapper, sleep: float, patience: int):
+        """
+        Yields thumbnails of result page opened in scrapper.webdriver: data URIs and lazy loaded thumbnail urls.
+        All new thumbnails are read in one round trip, then page loads more results. Nothing is clicked
+
+        :param scrapper: ImageScrapper() obj
+        :param sleep: max wait for more results
+        :param patience: attempts to load more results without new thumbnails before giving up
+        :return: generator of data URIs and urls
+        """
+        start = 0
+        stale = 0
+        while stale < patience and not scrapper.cancelled:
+            result = scrapper.webdriver.execute_script(page_scripts.THUMBNAIL_SRCS, self.thumbnail_selector, start)
+            if result['count'] > start:
+                stale = 0
+                info_log.info(f'Found {result["count"]} thumbnails! Harvesting {start}:{result["count"]}...')
+                start = result['count']
+                yield from result['srcs']
+            else:
+                stale += 1
+            self.more_results(scrapper, thumbnail_count=start, sleep=sleep)
+        info_log.info(f'No more results for "{scrapper.query}"')
+
+    def more_results(self, scrapper, thumbnail_count: int, sleep: float) -> None:
+        """
+        Makes result page show more thumbnails, scrolls to the end by default
+
+        :param scrapper: ImageScrapper() obj
+        :param thumbnail_count: thumbnails on page now
+        :param sleep: max wait for new content
+        :return: None
+        """
+        scrapper.scroll_to_end(sleep=sleep)
+
+    def parse_thumbnails(self, text: str) -> list:
+        """
+        Parses thumbnails from result page html for http backend: data URIs and thumbnail urls
+
+        :param text: page html
+        :return: list of data URIs and urls
+        """
+        return _data_uris(text) + [_json_string(raw) for raw in self.thumbnail_re.findall(html.unescape(text))]
+
+
+@register_engine
+class Google(SearchEngine):
+    name = 'Google'
+    url_template = 'https://www.google.com/search?safe=off&site=&tbm=isch&source=hp&q={q}&oq={q}&gs_l=img'
+    page_param = '&ijn={page}'
+    img_re = re.compile(r'\["(https?://[^"]+)",\d+,\d+\]')
+    thumbnail_selector = 'img.Q4LuWd'
+    thumbnail_re = re.compile(r'\["(https?://[^"]+/images\?q(?:=|\\u003d)tbn:[^"]+)",\d+,\d+\]')
+
+    def browser_urls(self, scrapper, sleep: float, patience: int, extraction: str, batch_size: int):
+        if extraction == 'batch':
+            return self._batch_urls(scrapper, sleep=sleep, patience=patience, batch_size=batch_size)
+        return self._element_urls(scrapper, sleep=sleep, patience=patience)
+
+    @staticmethod
+    def _load_more(scrapper, thumbnail_img_count: int, sleep: float) -> None:
+        info_log.info(f'Found {scrapper.img_count} image links, looking for more...')
+        clicked = scrapper.webdriver.execute_script('let button = document.querySelector(".mye4qd"); '
+                                                    'if (button) button.click(); return !!button;')
+        if clicked:
+            scrapper.waiter.until(lambda: scrapper.webdriver.execute_script(page_scripts.GOOGLE_THUMBNAIL_COUNT) >
+                                  thumbnail_img_count, max_timeout=sleep)
+
+    def _element_urls(self, scrapper, sleep: float, patience: int):
+        """
+        Clicks thumbnails one by one with webdriver, stops when page has no new thumbnails
+        """
+        scrapper.result_start = 0
+        stale = 0
+        while stale < patience and not scrapper.cancelled:
+            scrapper.scroll_to_end(sleep=sleep)
+
+            #  find all img tags
+            thumbnail_images = scrapper.webdriver.find_elements_by_css_selector('img.Q4LuWd')
+            thumbnail_img_count = len(thumbnail_images)
+            if thumbnail_img_count <= scrapper.result_start:
+                stale += 1
+            else:
+                stale = 0
+            info_log.info(f'Found {thumbnail_img_count} thumbnail images! '
+                          f'Extracting links from {scrapper.result_start}:{thumbnail_img_count}...')
+
+            #  try clicking on thumbnail
+            for thumbnail_img in thumbnail_images[scrapper.result_start:thumbnail_img_count]:
+                if scrapper.cancelled:
+                    break
+                shown = set(scrapper.webdriver.execute_script(page_scripts.GOOGLE_FULL_SRC))
+                try:
+                    thumbnail_img.click()
+                except Exception as err:
+                    error_log.exception(f'{err}\n')
+                    continue
+
+                #  wait until viewer swaps preview for full img url
+                new_srcs = scrapper.waiter.until(
+                    lambda: [src for src in scrapper.webdriver.execute_script(page_scripts.GOOGLE_FULL_SRC)
+                             if src.startswith('http') and src not in shown],
+                    max_timeout=sleep)
+                yield from new_srcs or ()
+
+            #  loads more images
+            self._load_more(scrapper, thumbnail_img_count=thumbnail_img_count, sleep=sleep)
+            scrapper.result_start = thumbnail_img_count
+        info_log.info(f'No more results for "{scrapper.query}"')
+
+    def _batch_urls(self, scrapper, sleep: float, patience: int, batch_size: int):
+        """
+        Clicks thumbnails and collects full size src inside the page,
+        one webdriver round trip per batch_size thumbnails
+        """
+        from selenium.common.exceptions import WebDriverException  # browser backend only, loaded on first use
+        scrapper.webdriver.execute_script(page_scripts.INSTALL_SRC_OBSERVER, 'img.n3VNCb')
+        scrapper.result_start = 0
+        stale = 0
+        while stale < patience and not scrapper.cancelled:
+            scrapper.scroll_to_end(sleep=sleep)
+            thumbnail_img_count = scrapper.webdriver.execute_script(page_scripts.GOOGLE_THUMBNAIL_COUNT)
+            if thumbnail_img_count <= scrapper.result_start:
+                stale += 1
+            else:
+                stale = 0
+            info_log.info(f'Found {thumbnail_img_count} thumbnail images! '
+                          f'Extracting links from {scrapper.result_start}:{thumbnail_img_count}...')
+
+            while scrapper.result_start < thumbnail_img_count and not scrapper.cancelled:
+                count = min(batch_size, thumbnail_img_count - scrapper.result_start)
+                try:
+                    yield from scrapper.run_batch(page_scripts.GOOGLE_CLICK_BATCH, count, sleep,
+                                                  scrapper.result_start)
+                except WebDriverException as err:
+                    error_log.exception(f'{err}\n')
+                scrapper.result_start += count
+
+            #  loads more images
+            self._load_more(scrapper, thumbnail_img_count=thumbnail_img_count, sleep=sleep)
+        info_log.info(f'No more results for "{scrapper.query}"')
+
+    def more_results(self, scrapper, thumbnail_count: int, sleep: float) -> None:
+        scrapper.scroll_to_end(sleep=sleep)
+        self._load_more(scrapper, thumbnail_img_count=thumbnail_count, sleep=sleep)
+
+    def parse_page(self, text: str) -> list:
+        #  page embeds full size images in script data as ["url", height, width], gstatic ones are thumbnails
+        thumbnails = set(self.thumbnail_re.findall(text))
+        return [_json_string(raw) for raw in self.img_re.findall(text)
+                if 'gstatic.com' not in raw and raw not in thumbnails]
+
+
+@register_engine
+class Yandex(SearchEngine):
+    name = 'Yandex'
+    url_template = 'https://yandex.ru/images/search?text={q}'
+    page_param = '&p={page}'
+    img_re = re.compile(r'"(?:img_href|origUrl)":"(https?://[^"]+)"')
+    thumbnail_selector = 'img.serp-item__thumb'
+    thumbnail_re = re.compile(r'(?:src=|"url":)"((?:https?:)?//[^"\s]+/i\?id=[^"\s]+)"')
+
+    def browser_urls(self, scrapper, sleep: float, patience: int, extraction: str, batch_size: int):
+        if extraction == 'batch':
+            return self._batch_urls(scrapper, sleep=sleep, patience=patience, batch_size=batch_size)
+        return self._element_urls(scrapper, sleep=sleep, patience=patience)
+
+    @staticmethod
+    def _first_thumbnail(scrapper, sleep: float):
+        thumbnail_img = scrapper.waiter.until(
+            lambda: scrapper.webdriver.find_element_by_css_selector('div.serp-item__preview'), max_timeout=sleep)
+        if thumbnail_img is None:
+            error_log.error(f'No results for "{scrapper.query}"\n')
+        return thumbnail_img
+
+    def _element_urls(self, scrapper, sleep: float, patience: int):
+        """
+        Flips through viewer with ARROW_DOWN, stops when viewer does not show new image several times in a row
+        """
+        from selenium.webdriver.common.keys import Keys  # browser backend only, loaded on first use
+        #  try clicking on first image
+        thumbnail_img = self._first_thumbnail(scrapper, sleep=sleep)
+        if thumbnail_img is None:
+            return
+        thumbnail_img.click()
+        html_elem = scrapper.webdriver.find_element_by_tag_name('html')  # where to send ARROW_DOWN key call
+        last_src = None
+
+        def next_src() -> str or None:
+            current = scrapper.webdriver.execute_script(page_scripts.YANDEX_FULL_SRC)
+            return current if current and current.startswith('http') and current != last_src else None
+
+        stale = 0
+        while stale < patience and not scrapper.cancelled:
+            #  wait until viewer shows next image
+            src = scrapper.waiter.until(next_src, max_timeout=sleep)
+            if src:
+                stale = 0
+                last_src = src
+                yield src
+            else:
+                stale += 1
+            html_elem.send_keys(Keys.ARROW_DOWN)
+        info_log.info(f'No more results for "{scrapper.query}"')
+
+    def _batch_urls(self, scrapper, sleep: float, patience: int, batch_size: int):
+        """
+        Flips viewer and collects full size src inside the page, one webdriver round trip per batch_size images.
+        Falls back to webdriver flips if viewer ignores synthetic key presses
+        """
+        thumbnail_img = self._first_thumbnail(scrapper, sleep=sleep)
+        if thumbnail_img is None:
+            return
+        scrapper.webdriver.execute_script(page_scripts.INSTALL_SRC_OBSERVER, 'img.MMImage-Origin')
+        thumbnail_img.click()
+        first_src = scrapper.waiter.until(lambda: scrapper.webdriver.execute_script(page_scripts.DRAIN_SRC_BUFFER),
+                                          max_timeout=sleep)
+        yield from first_src or ()
+
+        flipped = False
+        stale = 0
+        while stale < patience and not scrapper.cancelled:
+            srcs = scrapper.run_batch(page_scripts.YANDEX_FLIP_BATCH, batch_size, sleep)
+            if srcs:
+                flipped = True
+                stale = 0
+                yield from srcs
+            elif not flipped:
+                info_log.info('Viewer ignores synthetic key presses, flipping with webdriver')
+                scrapper.webdriver.get(url=self.search_url(query=scrapper.query,
+                                                           template=scrapper.url_templates.get(self.name)))
+                yield from self._element_urls(scrapper, sleep=sleep, patience=patience)
+                return
+            else:
+                stale += 1
+        info_log.info(f'No more results for "{scrapper.query}"')
+
+    def parse_page(self, text: str) -> list:
+        #  serp items keep full size url in data-bem json as img_href or origUrl
+        return [_json_string(raw) for raw in self.img_re.findall(html.unescape(text))]
+
+    def parse_thumbnails(self, text: str) -> list:
+        #  thumbnail urls are protocol relative, //avatars.mds.yandex.net/i?id=...
+        return [f'https:{url}' if url.startswith('//') else url for url in super().parse_thumbnails(text)]
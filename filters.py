@@ -0,0 +1,159 @@
+#! /usr/bin/env python3
+import os
+import re
+from PIL import Image, ImageFile
+from loggers import error_log
+
+"""
+Image filters checked before download: file size comes from response headers,
+format and resolution from first bytes of the file, so rejected images are never fully downloaded
+"""
+
+PROBE_BYTES = 64 * 1024  # enough for header of almost any image, JPEG with big EXIF may need more
+PROBE_CHUNK = 8 * 1024
+_CONTENT_RANGE_RE = re.compile(r'bytes \d+-\d+/(\d+)')
+
+
+class ImageInfo:
+    """
+    What is known about image without downloading it, unknown values are None
+    """
+
+    def __init__(self, size: int = None, image_format: str = None, width: int = None, height: int = None):
+        self.size = size
+        self.format = image_format
+        self.width = width
+        self.height = height
+
+    def __repr__(self):
+        return f'ImageInfo({self.format}, {self.width}x{self.height}, {self.size} bytes)'
+
+
+def _total_size(response) -> int or None:
+    content_range = _CONTENT_RANGE_RE.match(response.headers.get('Content-Range', ''))
+    if content_range:
+        return int(content_range.group(1))
+    if response.status_code == 200 and response.headers.get('Content-Length', '').isdigit():
+        return int(response.headers['Content-Length'])
+    return None
+
+
+def probe(session, url: str, timeout, probe_bytes: int = PROBE_BYTES, header: bool = True) -> ImageInfo:
+    """
+    Fetches image size, format and resolution with Range request, reads at most probe_bytes.
+    Server which ignores Range sends whole file, its response is closed after probe_bytes
+
+    :param session: requests.Session() obj
+    :param url: image url
+    :param timeout: requests timeout
+    :param probe_bytes: max bytes to read
+    :param header: parse format and resolution, HEAD request for file size only if False
+    :return: ImageInfo() obj
+    """
+    if not header:
+        response = session.head(url=url, timeout=timeout, allow_redirects=True)
+        response.raise_for_status()
+        return ImageInfo(size=_total_size(response))
+
+    with session.get(url=url, timeout=timeout, stream=True, headers={'Range': f'bytes=0-{probe_bytes - 1}'}) \
+            as response:
+        response.raise_for_status()
+        info = ImageInfo(size=_total_size(response))
+        parser = ImageFile.Parser()
+        read = 0
+        for chunk in response.iter_content(chunk_size=PROBE_CHUNK):
+            try:
+                parser.feed(chunk)
+            except Exception as err:
+                error_log.error(f'Can not parse header of {url} - {err}\n')
+                break
+            read += len(chunk)
+            if parser.image is not None or read >= probe_bytes:
+                break
+    if parser.image is not None:
+        info.format = parser.image.format
+        info.width, info.height = parser.image.size
+    return info
+
+
+class ImageFilter:
+    """
+    Limits for images to download. Every limit is optional, None means no limit
+    """
+
+    def __init__(self, min_width: int = None, max_width: int = None, min_height: int = None,
+                 max_height: int = None, min_aspect: float = None, max_aspect: float = None,
+                 formats=None, min_bytes: int = None, max_bytes: int = None, probe_bytes: int = PROBE_BYTES):
+        """
+        :param min_width: min width in px
+        :param max_width: max width in px
+        :param min_height: min height in px
+        :param max_height: max height in px
+        :param min_aspect: min width / height
+        :param max_aspect: max width / height
+        :param formats: allowed PIL format names, e.g. ['JPEG', 'PNG']
+        :param min_bytes: min file size
+        :param max_bytes: max file size
+        :param probe_bytes: max bytes read to find resolution
+        """
+        self.min_width = min_width
+        self.max_width = max_width
+        self.min_height = min_height
+        self.max_height = max_height
+        self.min_aspect = min_aspect
+        self.max_aspect = max_aspect
+        self.formats = {name.upper().replace('JPG', 'JPEG') for name in formats} if formats else None
+        self.min_bytes = min_bytes
+        self.max_bytes = max_bytes
+        self.probe_bytes = probe_bytes
+
+    @property
+    def needs_header(self) -> bool:
+        limits = (self.min_width, self.max_width, self.min_height, self.max_height, self.min_aspect, self.max_aspect,
+                  self.formats)
+        return any(limit is not None for limit in limits)
+
+    def check(self, info: ImageInfo) -> str or None:
+        """
+        Checks known image properties, unknown ones pass
+
+        :param info: ImageInfo() obj
+        :return: rejection reason or None if image passes
+        """
+        if info.size is not None:
+            if self.min_bytes is not None and info.size < self.min_bytes:
+                return f'{info.size} bytes is less than {self.min_bytes}'
+            if self.max_bytes is not None and info.size > self.max_bytes:
+                return f'{info.size} bytes is more than {self.max_bytes}'
+        if info.format is not None and self.formats and info.format not in self.formats:
+            return f'format {info.format} is not allowed'
+        if info.width is None or info.height is None:
+            return None
+        for name, value, low, high in (('width', info.width, self.min_width, self.max_width),
+                                       ('height', info.height, self.min_height, self.max_height)):
+            if low is not None and value < low:
+                return f'{name} {value} is less than {low}'
+            if high is not None and value > high:
+                return f'{name} {value} is more than {high}'
+        aspect = info.width / info.height if info.height else 0
+        if self.min_aspect is not None and aspect < self.min_aspect or \
+                self.max_aspect is not None and aspect > self.max_aspect:
+            return f'aspect ratio {aspect:.2f} is out of limits'
+        return None
+
+    def check_file(self, path: str) -> str or None:
+        """
+        Checks downloaded file, catches images which probe could not fully describe
+
+        :param path: downloaded file
+        :return: rejection reason or None if image passes
+        """
+        info = ImageInfo(size=os.path.getsize(path))
+        if self.needs_header:
+            try:
+                with Image.open(path) as image:  # reads header only
+                    info.format = image.format
+                    info.width, info.height = image.size
+            except Exception:
+                pass  # processing stage reports broken file
+        return self.check(info)
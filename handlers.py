@@ -1,19 +1,21 @@
 #! /usr/bin/env python3
 import os
-import shutil
 import tkinter as tk
 import webbrowser
-import logging
 import threading
-import psutil
-from scrapper import ImageScrapper
+from engines import ENGINES, MULTI_ENGINE
+from driver_pool import DriverPool
+from cancel import CancelToken
+from manifest import JobManifest
 from tkinter import messagebox as mb
-from loggers import error_log
+from loggers import error_log, set_job_id
+from metrics import METRICS, CallbackSink
 
 """
-Handle keypress, click, other events
+Handle keypress, click, other events. Scrapping modules are imported on first use, so window shows up quickly
 """
 SRC_DIR = os.path.dirname(__file__)  # executable path
+JOIN_TIMEOUT = 10  # seconds window close waits for running job to stop
 
 
 class StartButton:
@@ -21,14 +23,21 @@ class StartButton:
     Handles start button
     """
     scrapper = None
+    cancel_token = None  # CancelToken() obj of running job, Stop and window close cancel it
+    thread = None  # worker thread of running job
+    pool = DriverPool(size=len(ENGINES))  # keeps browsers warm between queries, one per engine for fan-out
 
     def __init__(self, master):
         #  GUI params
         self.master = master
         self.progressbar = None
         self.button = None
+        self.progress = 0  # finished downloads, counted from metrics events
+        self.progress_sink = CallbackSink(callback=self.count_progress)
+        self.progress_lock = threading.Lock()
 
         # scrapper params
+        self.backend = 'browser'  # or 'http' to scrape without browser
         self.search_engine = None
         self.query = None
         self.max_urls = None
@@ -40,40 +49,57 @@ class StartButton:
         :return: None
         """
         if self.query != '' and self.max_urls != '' and not self.max_urls.isalpha():
-            if self.search_engine == 'Google':
-                self.progressbar.place(x=40, y=122)
-                self.progressbar.start()
-                StartButton.scrapper = ImageScrapper()
-                StartButton.scrapper.scrape_google(query=self.query, max_urls=int(self.max_urls))
-            if self.search_engine == 'Yandex':
-                self.progressbar.place(x=40, y=122)
-                self.progressbar.start()
-                StartButton.scrapper = ImageScrapper()
-                StartButton.scrapper.scrape_yandex(query=self.query, max_urls=int(self.max_urls))
-            if self.search_engine != 'Google' and self.search_engine != 'Yandex':
+            if self.search_engine not in ENGINES and self.search_engine != MULTI_ENGINE:
                 error_log.error(f'No such search engine {self.search_engine}\n')
                 mb.showerror(title='Error', message=f'No such search engine {self.search_engine}!')
                 return
-            result = StartButton.scrapper.download_image()
-            if result:
+            self.progress = 0
+            self.progressbar.config(maximum=int(self.max_urls), value=0)
+            self.progressbar.place(x=40, y=122)
+            from scrapper import create_scrapper  # pulls requests, PIL and selenium, worker thread waits for them
+            kwargs = {'pool': StartButton.pool} if self.backend == 'browser' else {}
+            StartButton.scrapper = create_scrapper(backend=self.backend, search_engine=self.search_engine, **kwargs)
+            StartButton.scrapper.cancel_token = StartButton.cancel_token
+            manifest = JobManifest.create()
+            set_job_id(manifest.job_id)
+            METRICS.add_sink(self.progress_sink)
+            try:
+                result = StartButton.scrapper.scrape_and_download(search_engine=self.search_engine, query=self.query,
+                                                                  max_urls=int(self.max_urls), manifest=manifest)
+            finally:
+                METRICS.remove_sink(self.progress_sink)
+                set_job_id(None)
+            if StartButton.cancel_token.cancelled:
+                if result and mb.askyesno(title='Stopped',
+                                          message=f'Stopped, {manifest.completed()} images downloaded. '
+                                                  f'Open directory?'):
+                    webbrowser.open(result)
+                self.progressbar.place_forget()
+            elif result:
                 if mb.askyesno(title='Success', message='Downloading complete. Open directory?'):
                     webbrowser.open(result)
-                    self.progressbar.stop()
                     self.progressbar.place_forget()
-                self.progressbar.stop()
                 self.progressbar.place_forget()
             else:
                 mb.showinfo(title='Info', message='No images found.')
-                self.progressbar.stop()
                 self.progressbar.place_forget()
         else:
             mb.showerror(title='Error', message='Invalid query and/or number!')
 
+    def count_progress(self, kind: str, name: str, value: float, labels: dict) -> None:
+        """
+        Metrics callback, called from download threads, so it only counts. Progressbar is updated by check_thread()
+        """
+        if name == 'downloads_total':
+            with self.progress_lock:
+                self.progress += 1
+
     def start_button(self, search_engine: str, query: str, max_urls: str, progressbar, button) -> None:
         """
-        Gathers parameters from widgets and initializes thread and selenium webdriver
+        Gathers parameters from widgets and initializes thread and selenium webdriver.
+        Click on running job stops it: current downloads finish and browser goes back to pool
 
-        :param search_engine: Google or Yandex
+        :param search_engine: registered engine name, e.g. Google
         :param query: What to search
         :param max_urls: Number of images to download
         :param progressbar: ttk.Progressbar() obj
@@ -81,22 +107,29 @@ class StartButton:
 
         :return: None
         """
+        if StartButton.thread is not None and StartButton.thread.is_alive():
+            StartButton.cancel_token.cancel(reason='stopped by user')
+            button.config(text='Stopping')
+            button.config(state=tk.DISABLED)
+            return
         self.progressbar = progressbar
         self.button = button
         self.search_engine = search_engine
         self.query = query
         self.max_urls = max_urls
-        self.button.config(text='Working')
-        self.button.config(state=tk.DISABLED)
+        self.button.config(text='Stop')
+        StartButton.cancel_token = CancelToken()
         thread = threading.Thread(target=self.search_and_download,
                                   daemon=True)
+        StartButton.thread = thread
         thread.start()
         self.check_thread(master=self.master, thread=thread, button=self.button)
 
     def check_thread(self, master, thread, button) -> None:
         """
-        Checks if thread is alive
+        Checks if thread is alive, moves progressbar
         """
+        self.progressbar['value'] = self.progress
         if thread.is_alive():
             master.after(100, lambda: self.check_thread(master=master, thread=thread, button=button))
         else:
@@ -113,50 +146,18 @@ class CloseButton:
 
     def close_button(self) -> None:
         """
-        Handles close window button, moves log files to Log dir if created
+        Handles close window button, stops running job and closes browsers
 
         :return: None
         """
         if mb.askokcancel(title='Quit', message='Do you want to quit?'):
-            #  check if info_log files are even created
-            if os.path.exists(os.path.join(SRC_DIR, 'info_log.log')):
-                log_dir = os.path.join(SRC_DIR, 'Log')
-                if not os.path.exists(log_dir):
-                    os.mkdir(log_dir)
-                logging.shutdown()
-                #  if there is no log file in Log dir
-                if not os.path.exists(os.path.join(SRC_DIR, 'Log', 'info_log.log')):
-                    shutil.move(src=os.path.join(SRC_DIR, 'info_log.log'),
-                                dst=os.path.join(SRC_DIR, 'Log', 'info_log.log'))
-                else:
-                    #  append new_log content to old_log content and removes new_log file
-                    with open(file=os.path.join(SRC_DIR, 'info_log.log'), mode='r', encoding='UTF-8') as new_log, open(
-                            file=os.path.join(SRC_DIR, 'Log', 'info_log.log'), mode='a', encoding='UTf-8') as old_log:
-                        for line in new_log:
-                            old_log.write(line)
-                    os.remove(os.path.join(SRC_DIR, 'info_log.log'))
-            #  check if error_log files are even created
-            if os.path.exists(os.path.join(SRC_DIR, 'error_log.log')):
-                log_dir = os.path.join(SRC_DIR, 'Log')
-                if not os.path.exists(log_dir):
-                    os.mkdir(log_dir)
-                logging.shutdown()
-                #  if there is no log file in Log dir
-                if not os.path.exists(os.path.join(SRC_DIR, 'Log', 'error_log.log')):
-                    shutil.move(src=os.path.join(SRC_DIR, 'error_log.log'),
-                                dst=os.path.join(SRC_DIR, 'Log', 'error_log.log'))
-                else:
-                    #  append new_log content to old_log content and removes new_log file
-                    with open(file=os.path.join(SRC_DIR, 'error_log.log'), mode='r', encoding='UTF-8') as new_log, open(
-                            file=os.path.join(SRC_DIR, 'Log', 'error_log.log'), mode='a', encoding='UTf-8') as old_log:
-                        for line in new_log:
-                            old_log.write(line)
-                    os.remove(os.path.join(SRC_DIR, 'error_log.log'))
-
-            # in case of emergency closing GUI and selenium webdriver is still active
-            process_set = {process.name().lower() for process in psutil.process_iter()}
-            if 'chromedriver.exe' in process_set and isinstance(StartButton.scrapper, ImageScrapper):
-                StartButton.scrapper.webdriver.quit()
+            #  job stops at next step and returns its browser to pool, which quits them all
+            if StartButton.thread is not None and StartButton.thread.is_alive():
+                StartButton.cancel_token.cancel(reason='window closed')
+                StartButton.thread.join(timeout=JOIN_TIMEOUT)
+            if StartButton.scrapper is not None:
+                StartButton.scrapper.close()  # no-op if job closed it already
+            StartButton.pool.close()
 
             self.master.destroy()
 
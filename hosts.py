@@ -0,0 +1,216 @@
+#! /usr/bin/env python3
+import time
+import random
+import threading
+from urllib.parse import urlsplit
+import requests
+from loggers import info_log
+from metrics import METRICS
+
+"""
+Per-host download scheduling: token bucket rate limit, concurrency cap,
+retries of transient errors with jittered exponential backoff and circuit breaker for failing hosts
+"""
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class HostUnavailable(Exception):
+    """
+    Circuit breaker of the host is open, request is not sent
+    """
+
+
+def is_transient(err: Exception) -> bool:
+    """
+    Checks if request may succeed when repeated: timeouts, dropped connections, 429 and 5xx
+
+    :param err: exception raised by request
+    :return: bool
+    """
+    if isinstance(err, (requests.Timeout, requests.ConnectionError)):
+        return True
+    if isinstance(err, requests.HTTPError) and err.response is not None:
+        return err.response.status_code in RETRY_STATUSES
+    return False
+
+
+def _retry_after(err: Exception) -> float or None:
+    response = getattr(err, 'response', None)
+    value = response.headers.get('Retry-After', '') if response is not None else ''
+    return float(value) if value.isdigit() else None
+
+
+class TokenBucket:
+    """
+    Allows rate requests per second on average and burst requests at once
+    """
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> None:
+        """
+        Takes one token, blocks until it is available
+
+        :return: None
+        """
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+class CircuitBreaker:
+    """
+    Opens after threshold urls in a row failed all retries, rejects requests for cooldown seconds,
+    then lets one trial request through: success closes it, any failure opens it again
+    """
+
+    def __init__(self, threshold: int = 5, cooldown: float = 30):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self._opened = None
+        self._trial = False
+        self._lock = threading.Lock()
+
+    @property
+    def is_open(self) -> bool:
+        return self._opened is not None
+
+    def allow(self) -> bool:
+        """
+        Checks if request may be sent
+
+        :return: bool
+        """
+        with self._lock:
+            if self._opened is None:
+                return True
+            if not self._trial and time.monotonic() - self._opened >= self.cooldown:
+                self._trial = True  # half open, only this request goes through
+                return True
+            return False
+
+    def success(self) -> None:
+        with self._lock:
+            self.failures = 0
+            self._opened = None
+            self._trial = False
+
+    def failure(self, final: bool = True) -> bool:
+        """
+        Counts failure
+
+        :param final: request will not be retried, retried ones matter only for trial request
+        :return: True if breaker has just opened
+        """
+        with self._lock:
+            self.failures += final
+            if self._trial or self._opened is None and self.failures >= self.threshold:
+                self._opened = time.monotonic()
+                self._trial = False
+                return True
+            return False
+
+
+class _Host:
+
+    def __init__(self, scheduler):
+        self.bucket = TokenBucket(rate=scheduler.rate, burst=scheduler.burst)
+        self.slots = threading.BoundedSemaphore(scheduler.max_per_host)
+        self.breaker = CircuitBreaker(threshold=scheduler.failure_threshold, cooldown=scheduler.cooldown)
+
+
+class HostScheduler:
+    """
+    Runs requests to the same host within its rate and concurrency limits. Shared by download threads
+    """
+
+    def __init__(self, rate: float = 10, burst: int = 10, max_per_host: int = 4, retries: int = 3,
+                 backoff: float = 0.5, max_backoff: float = 10, failure_threshold: int = 5, cooldown: float = 30):
+        """
+        :param rate: requests per second per host
+        :param burst: requests per host sent at once before rate limit starts
+        :param max_per_host: requests per host in flight
+        :param retries: repeats of transient error
+        :param backoff: first retry delay, doubled by every retry
+        :param max_backoff: max retry delay
+        :param failure_threshold: urls in a row failed after all retries which open host circuit breaker
+        :param cooldown: seconds before open breaker lets trial request through
+        """
+        self.rate = rate
+        self.burst = burst
+        self.max_per_host = max_per_host
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self._hosts = {}
+        self._lock = threading.Lock()
+
+    def host(self, url: str) -> _Host:
+        name = urlsplit(url).hostname or ''
+        with self._lock:
+            if name not in self._hosts:
+                self._hosts[name] = _Host(self)
+            return self._hosts[name]
+
+    def delay(self, attempt: int) -> float:
+        """
+        Full jitter backoff: random delay up to backoff * 2 ** attempt
+
+        :param attempt: retry number starting from 0
+        :return: seconds
+        """
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+
+    def call(self, url: str, request, cancel_token=None):
+        """
+        Runs request to url host, repeats it on transient errors
+
+        :param url: request url, its host picks limits
+        :param request: callable without args, sends request and raises on error
+        :param cancel_token: CancelToken() obj, no more retries once it is cancelled
+        :return: request() result
+        """
+        host = self.host(url)
+        for attempt in range(self.retries + 1):
+            if not host.breaker.allow():
+                raise HostUnavailable(f'Circuit breaker of {urlsplit(url).hostname} is open')
+            host.bucket.acquire()
+            try:
+                with host.slots:
+                    result = request()
+            except Exception as err:
+                if not is_transient(err):
+                    host.breaker.success()  # host answers, it is the url that fails
+                    raise
+                final = attempt == self.retries
+                METRICS.inc('request_errors_total', kind=type(err).__name__, final=final)
+                if host.breaker.failure(final=final):
+                    METRICS.inc('circuit_opened_total')
+                    info_log.info(f'Too many failures, pausing {urlsplit(url).hostname} for {self.cooldown}s')
+                if final or cancel_token is not None and cancel_token.cancelled:
+                    raise
+                #  slot is released while waiting, so other urls of the host keep going
+                delay = min(self.max_backoff, _retry_after(err) or self.delay(attempt))
+                if cancel_token is None:
+                    time.sleep(delay)
+                elif cancel_token.wait(delay):
+                    raise
+            else:
+                host.breaker.success()
+                return result
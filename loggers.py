@@ -1,49 +1,142 @@
 #! /usr/bin/env python3
-import logging.config
+import os
+import json
+import queue
+import atexit
+import logging
+import threading
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler, TimedRotatingFileHandler
 
 """
-Log settings
+Log settings. Loggers only put records into queue, background listener writes them to rotated files in Log dir,
+so scraping and download threads never wait for disk.
+
+Job processes of batch mode forward their records to listener of the main process with forward(),
+so every file has one writer. Records carry id of the job they belong to, see set_job_id()
 """
 
+LOG_DIR = os.path.join(os.path.dirname(__file__), 'Log')
+MAX_BYTES = 10 * 1024 ** 2
+BACKUPS = 5
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(job)s - %(message)s'
 
-logger_config = {
-    'version': 1,
-    'formatters': {
-        'formatter': {
-            'format': '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-        },
-    },
-    'handlers': {
-        'info_handler': {
-            'class': 'logging.FileHandler',
-            'formatter': 'formatter',
-            'filename': 'info_log.log',
-            'encoding': 'UTF-8',
-            'delay': 'True'
-        },
-        'error_handler': {
-            'class': 'logging.FileHandler',
-            'formatter': 'formatter',
-            'filename': 'error_log.log',
-            'encoding': 'UTF-8',
-            'delay': 'True'
-        }
-    },
-    'loggers': {
-        'info_log': {
-            'handlers': ['info_handler'],
-            'level': 'INFO',
-        },
-        'error_log': {
-            'handlers': ['error_handler'],
-            'level': 'ERROR'
-        }
-    },
-}
-
-logging.config.dictConfig(config=logger_config)
 info_log = logging.getLogger(name='info_log')
 error_log = logging.getLogger(name='error_log')
+info_log.setLevel(logging.INFO)
+error_log.setLevel(logging.ERROR)
+
+_job_id = None  # job of this process, jobs of one process run one after another
+_listener = None
+_listener_pid = None
+_lock = threading.Lock()
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    One JSON object per line
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        return json.dumps({'time': self.formatTime(record), 'logger': record.name, 'level': record.levelname,
+                           'job': getattr(record, 'job', '-'), 'process': record.process,
+                           'thread': record.threadName, 'message': record.getMessage()}, ensure_ascii=False)
+
+
+class _JobFilter(logging.Filter):
+    """
+    Stamps record with current job id, runs in the thread which logs
+    """
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.job = _job_id or '-'
+        return True
+
+
+def set_job_id(job_id: str or None) -> None:
+    """
+    Marks next records of this process with job id
+
+    :param job_id: e.g. manifest name, None when no job runs
+    :return: None
+    """
+    global _job_id
+    _job_id = job_id
+
+
+def _file_handler(path: str, logger_name: str, max_bytes: int, backups: int, when: str or None,
+                  json_format: bool) -> logging.Handler:
+    if when:
+        handler = TimedRotatingFileHandler(filename=path, when=when, backupCount=backups, encoding='UTF-8',
+                                           delay=True)
+    else:
+        handler = RotatingFileHandler(filename=path, maxBytes=max_bytes, backupCount=backups, encoding='UTF-8',
+                                      delay=True)
+    handler.setFormatter(JsonFormatter() if json_format else logging.Formatter(TEXT_FORMAT))
+    handler.addFilter(logging.Filter(name=logger_name))  # listener is shared, file takes records of its logger
+    return handler
+
+
+def _use_queue(log_queue) -> None:
+    handler = QueueHandler(log_queue)
+    handler.addFilter(_JobFilter())
+    for logger in (info_log, error_log):
+        for old_handler in logger.handlers[:]:
+            logger.removeHandler(old_handler)
+        logger.addHandler(handler)
+
+
+def _stop_listener() -> None:
+    global _listener
+    #  forked process inherits listener of parent, stopping it there would stop parent's one
+    if _listener is not None and _listener_pid == os.getpid():
+        _listener.stop()  # writes records left in queue
+        for handler in _listener.handlers:
+            handler.close()
+    _listener = None
+
+
+def configure(log_dir: str = LOG_DIR, max_bytes: int = MAX_BYTES, backups: int = BACKUPS, when: str = None,
+              json_format: bool = False, log_queue=None):
+    """
+    (Re)starts listener which writes info_log.log and error_log.log to log_dir
+
+    :param log_dir: dir for log files
+    :param max_bytes: size which rotates file, ignored if when is set
+    :param backups: rotated files to keep
+    :param when: time based rotation instead, e.g. 'midnight' or 'H', see TimedRotatingFileHandler
+    :param json_format: write JSON lines instead of text
+    :param log_queue: queue to listen to, multiprocessing.Queue() to take records of other processes
+    :return: queue listener reads from
+    """
+    global _listener, _listener_pid
+    log_queue = log_queue if log_queue is not None else queue.SimpleQueue()
+    os.makedirs(log_dir, exist_ok=True)
+    handlers = [_file_handler(path=os.path.join(log_dir, f'{name}.log'), logger_name=name, max_bytes=max_bytes,
+                              backups=backups, when=when, json_format=json_format)
+                for name in ('info_log', 'error_log')]
+    with _lock:
+        _stop_listener()
+        _use_queue(log_queue)
+        _listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+        _listener.start()
+        _listener_pid = os.getpid()
+    return log_queue
+
+
+def forward(log_queue) -> None:
+    """
+    Sends records of this process to listener of another process instead of own files
+
+    :param log_queue: queue returned by configure() of that process
+    :return: None
+    """
+    with _lock:
+        _stop_listener()
+        _use_queue(log_queue)
+
+
+configure()
+atexit.register(_stop_listener)
 
 
 if __name__ == '__main__':
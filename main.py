@@ -2,6 +2,7 @@
 import tkinter as tk
 from tkinter import ttk
 from handlers import StartButton, CloseButton, CreateToolTip, click_on_entry, set_focus, default_value_entry
+from engines import ENGINES, MULTI_ENGINE
 
 """
 Main GUI module
@@ -9,7 +10,7 @@ Main GUI module
 
 WINDOW_HEIGHT = 150
 WINDOW_WIDTH = 320
-SE_LIST = ['Google', 'Yandex', ]
+SE_LIST = list(ENGINES) + [MULTI_ENGINE]
 
 
 class MainWindow(tk.Tk):
@@ -88,7 +89,7 @@ class MainFrame(tk.Frame):
         self.mf_start_button.place(x=222, y=92)
 
         # PROGRESSBAR
-        self.mf_progressbar = ttk.Progressbar(master=self, mode='indeterminate')
+        self.mf_progressbar = ttk.Progressbar(master=self, mode='determinate')
 
         # TOOLTIPS
         self.tooltip = CreateToolTip(widget=self.mf_max_urls_entry, text='Specify required number of images')
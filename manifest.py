@@ -0,0 +1,147 @@
+#! /usr/bin/env python3
+import os
+import json
+import time
+import threading
+from datetime import datetime
+
+"""
+Append-only job manifest: what job is about, which urls were found and what happened to each of them.
+Every event is one json line written as soon as it happens, so job can be resumed after crash
+"""
+
+JOBS_DIR = os.path.join(os.path.dirname(__file__), 'Jobs')
+DONE_STATES = ('ok', 'skipped')  # failed downloads are retried on resume
+
+
+class JobManifest:
+    """
+    Job checkpoint file. Events: job, url, result, scraped (search is exhausted or target reached), done
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.job = None
+        self.discovered = {}  # url -> last download status or None, insertion ordered
+        self.scraped = False
+        self.done = False
+        self._lock = threading.Lock()
+        self._file = None
+        if os.path.exists(path):
+            self._replay()
+
+    @property
+    def job_id(self) -> str:
+        """
+        Manifest file name without extension, marks log records of the job
+        """
+        return os.path.splitext(os.path.basename(self.path))[0]
+
+    @classmethod
+    def create(cls, jobs_dir: str = JOBS_DIR):
+        """
+        New manifest file with unique name in jobs dir
+
+        :param jobs_dir: where to keep manifests
+        :return: JobManifest() obj
+        """
+        if not os.path.exists(jobs_dir):
+            os.makedirs(jobs_dir)
+        name = f'{datetime.now().strftime("%Y-%m-%d_%H-%M-%S.%f")}-{os.getpid()}.jsonl'
+        return cls(path=os.path.join(jobs_dir, name))
+
+    def _replay(self) -> None:
+        valid_size = 0
+        with open(file=self.path, mode='rb') as file:
+            for line in file:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    break  # line cut by crash, everything before it is valid
+                if not line.endswith(b'\n'):
+                    break
+                valid_size += len(line)
+                event = record.get('event')
+                if event == 'job':
+                    self.job = record
+                elif event == 'url':
+                    self.discovered.setdefault(record['url'], None)
+                elif event == 'result':
+                    self.discovered[record['url']] = record['status']
+                elif event == 'scraped':
+                    self.scraped = True
+                elif event == 'done':
+                    self.done = True
+        if valid_size < os.path.getsize(self.path):
+            os.truncate(self.path, valid_size)  # drops cut line, so new events start on fresh line
+
+    def _write(self, record: dict) -> None:
+        with self._lock:
+            if self._file is None:
+                self._file = open(file=self.path, mode='a', encoding='UTF-8', buffering=1)  # flushed per line
+            self._file.write(json.dumps(record, ensure_ascii=False) + '\n')
+
+    def close(self) -> None:
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def start(self, search_engine: str, query: str, max_urls: int, output: str, **params) -> None:
+        """
+        Records job params, does nothing if job is already recorded
+
+        :param search_engine: engine name
+        :param query: what to search
+        :param max_urls: number of images
+        :param output: download dir
+        :param params: other job params to keep, e.g. backend
+        :return: None
+        """
+        if self.job is None:
+            self.job = {'event': 'job', 'engine': search_engine, 'query': query, 'max_urls': max_urls,
+                        'output': output, 'created': time.time(), **params}
+            self._write(self.job)
+
+    def add_url(self, url: str) -> None:
+        """
+        Records found url, does nothing if it is already recorded
+
+        :param url: image url
+        :return: None
+        """
+        with self._lock:
+            if url in self.discovered:
+                return
+            self.discovered[url] = None
+        self._write({'event': 'url', 'url': url})
+
+    def add_result(self, result) -> None:
+        """
+        Records download outcome
+
+        :param result: DownloadResult() obj
+        :return: None
+        """
+        self.discovered[result.url] = result.status
+        self._write({'event': 'result', 'url': result.url, 'status': result.status, 'path': result.path,
+                     'reason': result.reason})
+
+    def mark_scraped(self) -> None:
+        self.scraped = True
+        self._write({'event': 'scraped'})
+
+    def mark_done(self) -> None:
+        self.done = True
+        self._write({'event': 'done'})
+
+    def pending(self) -> list:
+        """
+        Found urls which are not downloaded yet
+
+        :return: list of urls
+        """
+        return [url for url, status in self.discovered.items() if status not in DONE_STATES]
+
+    def completed(self) -> int:
+        return sum(status in DONE_STATES for status in self.discovered.values())
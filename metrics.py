@@ -0,0 +1,268 @@
+#! /usr/bin/env python3
+import os
+import json
+import time
+import bisect
+import threading
+from contextlib import contextmanager
+
+"""
+Hot path timers and counters. Code records into module level METRICS,
+sinks export them: JSON file, Prometheus text endpoint or callback which gets every event
+"""
+
+#  seconds, from fast local calls to slow downloads
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+PREFIX = 'scrapper_'
+
+
+class Histogram:
+    """
+    Cumulative bucket counts, sum and count of observed values
+    """
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # last one is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q: float) -> float or None:
+        """
+        Approximate quantile, upper bound of bucket where it falls
+
+        :param q: 0..1
+        :return: seconds or None if nothing observed
+        """
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float('inf')
+
+    def to_dict(self) -> dict:
+        return {'count': self.count, 'sum': round(self.sum, 6), 'p50': self.quantile(0.5),
+                'p99': self.quantile(0.99),
+                'buckets': dict(zip([str(bound) for bound in self.buckets] + ['+Inf'], self.counts))}
+
+
+def _key(name: str, labels: dict) -> tuple:
+    return name, tuple(sorted(labels.items()))
+
+
+def _label_text(labels: tuple, extra: str = '') -> str:
+    parts = [f'{name}="{str(value)}"' for name, value in labels]
+    if extra:
+        parts.append(extra)
+    return '{' + ','.join(parts) + '}' if parts else ''
+
+
+class Metrics:
+    """
+    Thread safe registry of counters and histograms. Every record is passed to sinks as event
+    """
+
+    def __init__(self):
+        self._counters = {}
+        self._histograms = {}
+        self._sinks = []
+        self._lock = threading.Lock()
+
+    def add_sink(self, sink) -> None:
+        """
+        :param sink: obj with emit(kind, name, value, labels) and close()
+        :return: None
+        """
+        with self._lock:
+            self._sinks = self._sinks + [sink]
+
+    def remove_sink(self, sink) -> None:
+        with self._lock:
+            self._sinks = [added for added in self._sinks if added is not sink]
+
+    def _emit(self, kind: str, name: str, value: float, labels: dict) -> None:
+        for sink in self._sinks:
+            sink.emit(kind, name, value, labels)
+
+    def inc(self, name: str, value: float = 1, **labels) -> None:
+        """
+        Adds value to counter
+
+        :param name: counter name, e.g. downloads_total
+        :param value: increment
+        :param labels: label values, keep their number of values small
+        :return: None
+        """
+        key = _key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+        self._emit('counter', name, value, labels)
+
+    def observe(self, name: str, value: float, **labels) -> None:
+        """
+        Records value in histogram
+
+        :param name: histogram name, e.g. download_seconds
+        :param value: observed value
+        :param labels: label values
+        :return: None
+        """
+        key = _key(name, labels)
+        with self._lock:
+            if key not in self._histograms:
+                self._histograms[key] = Histogram()
+            self._histograms[key].observe(value)
+        self._emit('histogram', name, value, labels)
+
+    @contextmanager
+    def timer(self, name: str, **labels):
+        """
+        Observes duration of with block in histogram
+
+        :param name: histogram name
+        :param labels: label values
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def snapshot(self) -> dict:
+        """
+        Current values
+
+        :return: dict with counters and histograms, keys are 'name{label="value"}'
+        """
+        with self._lock:
+            return {'time': time.time(), 'pid': os.getpid(),
+                    'counters': {f'{name}{_label_text(labels)}': value
+                                 for (name, labels), value in sorted(self._counters.items())},
+                    'histograms': {f'{name}{_label_text(labels)}': histogram.to_dict()
+                                   for (name, labels), histogram in sorted(self._histograms.items())}}
+
+    def prometheus_text(self) -> str:
+        """
+        Values in Prometheus text exposition format
+
+        :return: str
+        """
+        lines = []
+        typed = set()
+        with self._lock:
+            for (name, labels), value in sorted(self._counters.items()):
+                if name not in typed:
+                    typed.add(name)
+                    lines.append(f'# TYPE {PREFIX}{name} counter')
+                lines.append(f'{PREFIX}{name}{_label_text(labels)} {value}')
+            for (name, labels), histogram in sorted(self._histograms.items()):
+                if name not in typed:
+                    typed.add(name)
+                    lines.append(f'# TYPE {PREFIX}{name} histogram')
+                cumulative = 0
+                for bound, count in zip(histogram.buckets + ('+Inf',), histogram.counts):
+                    cumulative += count
+                    bucket_labels = _label_text(labels, extra=f'le="{bound}"')
+                    lines.append(f'{PREFIX}{name}_bucket{bucket_labels} {cumulative}')
+                lines.append(f'{PREFIX}{name}_sum{_label_text(labels)} {histogram.sum}')
+                lines.append(f'{PREFIX}{name}_count{_label_text(labels)} {histogram.count}')
+        return '\n'.join(lines) + '\n'
+
+    def reset(self) -> None:
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+
+METRICS = Metrics()
+
+
+class CallbackSink:
+    """
+    Calls callback(kind, name, value, labels) on every record, from recording thread
+    """
+
+    def __init__(self, callback):
+        self.callback = callback
+
+    def emit(self, kind: str, name: str, value: float, labels: dict) -> None:
+        self.callback(kind, name, value, labels)
+
+    def close(self) -> None:
+        pass
+
+
+class JsonFileSink:
+    """
+    Rewrites JSON file with metrics snapshot every interval seconds and on close
+    """
+
+    def __init__(self, path: str, metrics: Metrics = METRICS, interval: float = 5):
+        self.path = path
+        self.metrics = metrics
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='metrics-file', daemon=True)
+        self._thread.start()
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            self.write()
+
+    def write(self) -> None:
+        temp_path = f'{self.path}.tmp'
+        with open(file=temp_path, mode='w', encoding='UTF-8') as file:
+            json.dump(self.metrics.snapshot(), file, indent=1)
+        os.replace(temp_path, self.path)  # readers never see half written file
+
+    def emit(self, kind: str, name: str, value: float, labels: dict) -> None:
+        pass
+
+    def close(self) -> None:
+        self._stop.set()
+        self._thread.join()
+        self.write()
+
+
+class PrometheusSink:
+    """
+    Serves metrics at http://host:port/metrics in Prometheus text format
+    """
+
+    def __init__(self, port: int = 9464, host: str = '127.0.0.1', metrics: Metrics = METRICS):
+        from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler  # only exporting process needs it
+        sink = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args) -> None:
+                pass
+
+            def do_GET(self) -> None:
+                body = sink.metrics.prometheus_text().encode('UTF-8')
+                self.send_response(200 if self.path.startswith('/metrics') else 404)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        self.metrics = metrics
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self.port = self.server.server_port
+        threading.Thread(target=self.server.serve_forever, name='metrics-http', daemon=True).start()
+
+    def emit(self, kind: str, name: str, value: float, labels: dict) -> None:
+        pass
+
+    def close(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
@@ -0,0 +1,89 @@
+#! /usr/bin/env python3
+
+"""
+JavaScript executed inside result pages, every script costs one webdriver round trip
+"""
+
+GOOGLE_FULL_SRC = 'return Array.from(document.querySelectorAll("img.n3VNCb"), img => img.src);'
+GOOGLE_THUMBNAIL_COUNT = 'return document.querySelectorAll("img.Q4LuWd").length;'
+YANDEX_FULL_SRC = 'let img = document.querySelector("img.MMImage-Origin"); return img ? img.src : null;'
+
+#  arguments: css selector of full size img.
+#  Buffers every http src set on matching img (new element or changed src) into window.__isBuffer
+INSTALL_SRC_OBSERVER = '''
+if (!window.__isObserver) {
+    const selector = arguments[0];
+    window.__isBuffer = [];
+    const push = node => {
+        if (node.nodeType !== 1) return;
+        const images = node.matches(selector) ? [node] : Array.from(node.querySelectorAll(selector));
+        for (const img of images) {
+            if (img.src && img.src.startsWith('http')) window.__isBuffer.push(img.src);
+        }
+    };
+    window.__isObserver = new MutationObserver(mutations => {
+        for (const mutation of mutations) {
+            if (mutation.type === 'attributes') push(mutation.target);
+            else mutation.addedNodes.forEach(push);
+        }
+    });
+    window.__isObserver.observe(document.body,
+                                {subtree: true, childList: true, attributes: true, attributeFilter: ['src']});
+}
+'''
+
+DRAIN_SRC_BUFFER = 'let buffer = window.__isBuffer || []; window.__isBuffer = []; return buffer;'
+
+#  shared part of batch scripts: runs step(i) count times, after each step waits until buffer grows
+#  or timeout ms pass, then returns drained buffer and per step latency in seconds (null on timeout)
+_RUN_BATCH = '''
+const done = arguments[arguments.length - 1];
+const pause = ms => new Promise(resolve => setTimeout(resolve, ms));
+(async () => {
+    const latencies = [];
+    for (let i = 0; i < count; i++) {
+        const before = window.__isBuffer.length;
+        const start = performance.now();
+        try { step(i); } catch (err) { latencies.push(null); continue; }
+        while (window.__isBuffer.length === before && performance.now() - start < timeout) await pause(25);
+        latencies.push(window.__isBuffer.length > before ? (performance.now() - start) / 1000 : null);
+    }
+    const srcs = window.__isBuffer;
+    window.__isBuffer = [];
+    done({srcs: srcs, latencies: latencies});
+})();
+'''
+
+#  async, arguments: first thumbnail index, count, timeout ms
+GOOGLE_CLICK_BATCH = '''
+const [first, wanted, timeout] = arguments;
+const thumbnails = Array.from(document.querySelectorAll("img.Q4LuWd")).slice(first, first + wanted);
+const count = thumbnails.length;
+const step = i => thumbnails[i].click();
+''' + _RUN_BATCH
+
+#  async, arguments: count, timeout ms. Flips viewer with synthetic ARROW_DOWN
+YANDEX_FLIP_BATCH = '''
+const [count, timeout] = arguments;
+const step = i => {
+    const event = new KeyboardEvent('keydown', {key: 'ArrowDown', code: 'ArrowDown', bubbles: true});
+    Object.defineProperty(event, 'keyCode', {get: () => 40});
+    Object.defineProperty(event, 'which', {get: () => 40});
+    (document.activeElement || document.body).dispatchEvent(event);
+};
+''' + _RUN_BATCH
+
+#  arguments: css selector of thumbnail img, index of first thumbnail to read.
+#  Returns thumbnail srcs from that index: lazy loaded thumbnail gives its url from data-src or data-iurl,
+#  placeholder src (tiny gif) is skipped. Also returns number of thumbnails on page
+THUMBNAIL_SRCS = '''
+const [selector, first] = arguments;
+const thumbnails = document.querySelectorAll(selector);
+const srcs = [];
+for (let i = first; i < thumbnails.length; i++) {
+    const img = thumbnails[i];
+    const src = img.getAttribute('data-src') || img.getAttribute('data-iurl') || img.src;
+    if (src && (src.startsWith('http') || /^data:image\\/(jpeg|png|webp);base64,/.test(src))) srcs.push(src);
+}
+return {srcs: srcs, count: thumbnails.length};
+'''
@@ -0,0 +1,130 @@
+#! /usr/bin/env python3
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from PIL import Image
+from dedup_index import perceptual_hash
+from metrics import METRICS
+
+"""
+Image processing stage: decode, resize and encode run in worker processes,
+so CPU heavy transcoding does not hold GIL of download threads
+"""
+
+FORMATS = {'JPEG': 'jpeg', 'PNG': 'png', 'WEBP': 'webp'}  # output format -> file extension
+HASH_DRAFT_SIZE = (64, 64)  # perceptual hash needs only 9x8 pixels, JPEG is decoded at reduced scale
+
+
+def _fits(image: Image.Image, max_size: int or None) -> bool:
+    return not max_size or max(image.size) <= max_size
+
+
+def process_image(path: str, output_format: str = 'JPEG', quality: int = 85, max_size: int = None,
+                  passthrough: bool = True, with_phash: bool = False) -> tuple:
+    """
+    Converts downloaded image to output format. Runs in worker process, so it takes and returns plain values
+
+    :param path: downloaded file
+    :param output_format: JPEG, PNG or WEBP
+    :param quality: JPEG and WEBP quality
+    :param max_size: longest side of saved image, no resize if None
+    :param passthrough: keep source bytes if image is already in output format and fits max_size
+    :param with_phash: compute perceptual hash for dedup index
+    :return: (converted file path or None to keep downloaded file as is, file extension, perceptual hash or None)
+    """
+    with Image.open(path) as image:  # reads header only
+        return _convert(image, path=path, output_format=output_format, quality=quality, max_size=max_size,
+                        passthrough=passthrough, with_phash=with_phash)
+
+
+def _convert(image: Image.Image, path: str, output_format: str, quality: int, max_size: int or None,
+             passthrough: bool, with_phash: bool) -> tuple:
+    phash = None
+    if passthrough and image.format == output_format and _fits(image, max_size):
+        if with_phash:
+            image.draft('L', HASH_DRAFT_SIZE)
+            phash = perceptual_hash(image)
+        return None, FORMATS[output_format], phash
+
+    if max_size:
+        #  JPEG decoder skips detail which thumbnail() would throw away anyway
+        image.draft('RGB', (max_size, max_size))
+        image.thumbnail((max_size, max_size), Image.LANCZOS)
+    if output_format == 'JPEG':
+        image = image.convert('RGB')
+    elif image.mode not in ('RGB', 'RGBA', 'L', 'LA'):
+        image = image.convert('RGBA')
+    if with_phash:
+        phash = perceptual_hash(image)
+    #  written next to source, so only path goes back to calling process
+    output_path = f'{path}.{FORMATS[output_format]}'
+    image.save(output_path, output_format, quality=quality)
+    return output_path, FORMATS[output_format], phash
+
+
+class ImageProcessor:
+    """
+    Processing stage settings and worker process pool shared by download threads.
+    Pass-through JPEG that needs no resize is recognized by header in calling thread and never leaves it
+    """
+
+    def __init__(self, output_format: str = 'JPEG', quality: int = 85, max_size: int = None,
+                 passthrough: bool = True, processes: int = None):
+        """
+        :param output_format: JPEG, PNG or WEBP
+        :param quality: JPEG and WEBP quality
+        :param max_size: longest side of saved image in px, e.g. 256 for thumbnails, no resize if None
+        :param passthrough: save source file untouched if it is already in output format and fits max_size
+        :param processes: worker processes, cpu count if None, 0 to process in calling thread
+        """
+        output_format = output_format.upper().replace('JPG', 'JPEG')
+        if output_format not in FORMATS:
+            raise ValueError(f'Unsupported output format {output_format}')
+        self.output_format = output_format
+        self.quality = quality
+        self.max_size = max_size
+        self.passthrough = passthrough
+        self.processes = os.cpu_count() if processes is None else processes
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def _is_passthrough(self, path: str) -> bool:
+        try:
+            with Image.open(path) as image:
+                return image.format == self.output_format and _fits(image, self.max_size)
+        except Exception:
+            return False  # broken file is reported by worker
+
+    def process(self, path: str, with_phash: bool = False) -> tuple:
+        """
+        Converts downloaded image, blocks calling thread until worker process is done.
+        Worker reads file itself, so image bytes are not copied between processes
+
+        :param path: downloaded file
+        :param with_phash: compute perceptual hash for dedup index
+        :return: (converted file path or None to keep downloaded file as is, file extension, perceptual hash or None)
+        """
+        if self.passthrough and not with_phash and self._is_passthrough(path):
+            METRICS.inc('processed_total', mode='passthrough')
+            return None, FORMATS[self.output_format], None
+        kwargs = {'output_format': self.output_format, 'quality': self.quality, 'max_size': self.max_size,
+                  'passthrough': self.passthrough, 'with_phash': with_phash}
+        METRICS.inc('processed_total', mode='worker')
+        with METRICS.timer('process_seconds'):  # decode and encode, including wait for free worker
+            if not self.processes:
+                return process_image(path, **kwargs)
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ProcessPoolExecutor(max_workers=self.processes)
+            return self._executor.submit(process_image, path, **kwargs).result()
+
+    def close(self) -> None:
+        """
+        Stops worker processes
+
+        :return: None
+        """
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown()
+                self._executor = None
@@ -1,196 +1,575 @@
 #! /usr/bin/env python3
-import time
 import os
-import io
+import queue
+import threading
 import requests
-from PIL import Image
-from selenium import webdriver
-from selenium.webdriver.common.keys import Keys
-from webdriver_manager.chrome import ChromeDriverManager
-from datetime import datetime
+from downloader import Downloader, USER_AGENT
+from driver_pool import DriverPool, create_driver
 from loggers import info_log, error_log
+from urls import normalize_url, url_key, make_url_set, is_data_uri
+from waits import AdaptiveWait
+from engines import ENGINES, MULTI_ENGINE, get_engine
+from manifest import JobManifest
+from storage import SHARD_BYTES
+from metrics import METRICS
 
-SE_DICT = {
-    'Google': 'https://www.google.com/search?safe=off&site=&tbm=isch&source=hp&q={q}&oq={q}&gs_l=img',
-    'Yandex': 'https://yandex.ru/images/search?text={q}'
-}
+DOWNLOAD_DIR = os.path.join(os.path.dirname(__file__), 'Download')
 
 
-class ImageScrapper:
+class BaseScrapper:
     """
-    Scraps image from search engine and downloads it to 'Download' dir
+    Search and download logic shared by browser and http backends
     """
 
     def __init__(self):
-        # install webdriver
-        self.opts = webdriver.ChromeOptions()
-        self.opts.headless = True
-        self.opts.add_argument('start-maximized')
-        self.opts.add_argument('--disable-blink-features=AutomationControlled')
-        self.opts.add_argument('--incognito')
-        self.opts.add_experimental_option('excludeSwitches', ['enable-automation'])
-        self.opts.add_experimental_option('useAutomationExtension', False)
-        self.webdriver = webdriver.Chrome(executable_path=ChromeDriverManager().install(), options=self.opts)
-        self.webdriver.execute_script('Object.defineProperty(navigator, "webdriver", {get: () => undefined})')
-        self.webdriver.execute_cdp_cmd('Network.setUserAgentOverride',
-                                       {
-                                           "userAgent": 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 '
-                                                        '(KHTML, like Gecko) '
-                                                        'Chrome/83.0.4103.53 Safari/537.36'})
-
         #  params
         self.search_engine = None
         self.query = None
         self.img_urls = set()
         self.img_count = 0
-        self.result_start = 0
         self.sub_dir_name = ''
+        self.download_root = DOWNLOAD_DIR
+        self.download_results = []
+        self.index = None  # DedupIndex() obj, skips urls and images stored by earlier runs
+        self.processor = None  # ImageProcessor() obj with output format and size, JPEG pass-through if None
+        self.image_filter = None  # ImageFilter() obj, images out of limits are not downloaded
+        self.scheduler = None  # HostScheduler() obj with per-host limits and retries, default limits if None
+        self.layout = 'flat'  # output layout, see storage.LAYOUTS
+        self.shard_bytes = SHARD_BYTES
+        self.cancel_token = None  # CancelToken() obj, search and download stop when it is cancelled or expires
 
-    def scroll_to_end(self, sleep: int = 2) -> None:
+    @property
+    def cancelled(self) -> bool:
         """
-        Scrolls to the bottom
+        Checked by search loops and pipeline between steps
 
-        :param sleep: wait between interactions
-        :return: None
+        :return: True if job is cancelled or its deadline passed
         """
-        self.webdriver.execute_script('window.scrollTo(0, document.body.scrollHeight);')
-        time.sleep(sleep)
+        return self.cancel_token is not None and self.cancel_token.cancelled
 
-    def scrape_google(self, query: str, max_urls: int, sleep: int = 2) -> set:
+    def set_query(self, search_engine: str, query: str) -> None:
         """
-        Search Google for images by given query, return set of image urls
+        Stores search params and makes dir name from query
 
+        :param search_engine: registered engine name, e.g. Google
         :param query: what to search
-        :param max_urls: number of images
-        :param sleep: wait between interactions
-        :return: set of urls
+        :return: None
         """
-        self.search_engine = 'Google'
-        search_url = SE_DICT[self.search_engine]
-        self.webdriver.get(url=search_url.format(q=query))
+        self.search_engine = search_engine
         self.query = query
-
+        self.sub_dir_name = ''
         for char in self.query:
             if char not in r'<>:"/\|?*':
                 self.sub_dir_name += char
             else:
                 self.sub_dir_name += '_'
 
-        while self.img_count < max_urls:
-            self.scroll_to_end()
-
-            #  find all img tags
-            thumbnail_images = self.webdriver.find_elements_by_css_selector('img.Q4LuWd')
-            thumbnail_img_count = len(thumbnail_images)
-            info_log.info(f'Found {thumbnail_img_count} thumbnail images! '
-                          f'Extracting links from {self.result_start}:{thumbnail_img_count}...')
-
-            #  try clicking on thumbnail
-            for thumbnail_img in thumbnail_images[self.result_start:thumbnail_img_count]:
-                try:
-                    thumbnail_img.click()
-                    time.sleep(sleep)
-                except Exception as err:
-                    error_log.exception(f'{err}\n')
-                    continue
+    def download_dir(self) -> str:
+        """
+        Creates download dir for current query
+
+        :return: path to subdir
+        """
+        sub_dir_path = os.path.join(self.download_root, self.sub_dir_name.capitalize())
+        if not os.path.exists(sub_dir_path):
+            os.makedirs(sub_dir_path)
+        return sub_dir_path
+
+    def _is_known(self, url: str, seen, skip_urls=None) -> bool:
+        """
+        Checks if url was found before in this search, is in skip_urls or was downloaded by earlier run
+
+        :param url: normalized url
+        :param seen: url set of current search
+        :param skip_urls: container of known urls
+        :return: bool
+        """
+        if url_key(url) in seen or skip_urls is not None and url in skip_urls:
+            return True
+        return bool(self.index and self.index.has_url(url))
+
+    def _raw_urls(self, search_engine: str, query: str, **options):
+        """
+        Backend specific search, yields raw image urls found for query
 
-                #  get full img url
-                full_images = self.webdriver.find_elements_by_css_selector('img.n3VNCb')
-                for full_img in full_images:
-                    if full_img.get_attribute('src') and 'http' in full_img.get_attribute('src'):
-                        self.img_urls.add(full_img.get_attribute('src'))
-                self.img_count = len(self.img_urls)
+        :param search_engine: registered engine name, e.g. Google
+        :param query: what to search
+        :param options: backend extraction options
+        :return: generator of urls
+        """
+        raise NotImplementedError
+
+    def iter_image_urls(self, search_engine: str, query: str, max_urls: int, dedup: str = 'hash',
+                        stop_event: threading.Event = None, skip_urls=None, **options):
+        """
+        Search engine for images by given query, yield normalized image urls as soon as they are found.
+        Found urls are not stored, dedup keeps only hashes so memory stays flat on large runs
+
+        :param search_engine: registered engine name, e.g. Google
+        :param query: what to search
+        :param max_urls: number of images
+        :param dedup: 'hash' for exact hashed url set or 'bloom' for fixed size bloom filter
+        :param stop_event: threading.Event() obj, search stops when it is set
+        :param skip_urls: container of urls which are already known, e.g. from manifest
+        :param options: backend extraction options, see _raw_urls() of backend
+        :return: generator of urls
+        """
+        get_engine(search_engine)  # raises for unknown engine
+        self.set_query(search_engine=search_engine, query=query)
+        self.img_count = 0
+        seen = make_url_set(dedup=dedup, capacity=max(max_urls * 2, 1000))
 
-                #  exit while loop
-                if len(self.img_urls) >= max_urls:
+        raw_urls = self._raw_urls(search_engine=search_engine, query=query, **options)
+        try:
+            for raw_url in raw_urls:
+                if stop_event is not None and stop_event.is_set():
+                    break
+                if self.cancelled:
+                    info_log.info(f'Search for "{query}" stopped: {self.cancel_token.reason}, '
+                                  f'got {self.img_count} image links')
+                    break
+                url = raw_url if is_data_uri(raw_url) else normalize_url(raw_url)
+                if url is None or self._is_known(url=url, seen=seen, skip_urls=skip_urls):
+                    continue
+                seen.add(url_key(url))
+                self.img_count += 1
+                METRICS.inc('urls_found_total', engine=search_engine)
+                yield url
+                if self.img_count >= max_urls:
                     info_log.info(f'Got {self.img_count} image links!')
                     break
+        finally:
+            raw_urls.close()
 
-            #  loads more images
-            else:
-                info_log.info(f'Found {len(self.img_urls)} image links, looking for more...')
-                time.sleep(sleep)
-                load_more_button = self.webdriver.find_element_by_css_selector('.mye4qd')
-                if load_more_button:
-                    self.webdriver.execute_script('document.querySelector(".mye4qd").click();')
-            self.result_start = len(thumbnail_images)
-        # close browser
-        self.webdriver.quit()
-        return self.img_urls
-
-    def scrape_yandex(self, query: str, max_urls: int, sleep: int = 2) -> set:
+    def scrape(self, search_engine: str, query: str, max_urls: int, **options) -> set:
         """
-        Search Yandex for images by given query, return set of image urls
+        Search engine for images by given query, return set of image urls
 
+        :param search_engine: registered engine name, e.g. Google
         :param query: what to search
         :param max_urls: number of images
-        :param sleep: wait between interactions
+        :param options: backend extraction options, e.g. sleep - max wait between interactions for browser
         :return: set of urls
         """
-        self.search_engine = 'Yandex'
-        search_url = SE_DICT[self.search_engine]
-        self.webdriver.get(url=search_url.format(q=query))
-        self.query = query
+        try:
+            self.img_urls.update(self.iter_image_urls(search_engine=search_engine, query=query, max_urls=max_urls,
+                                                      **options))
+        except Exception as err:
+            error_log.exception(f'{err}\n')
+        self.close()
+        return self.img_urls
 
-        for char in self.query:
-            if char not in r'<>:"/\|?*':
-                self.sub_dir_name += char
-            else:
-                self.sub_dir_name += '_'
+    def scrape_google(self, query: str, max_urls: int, **options) -> set:
+        """
+        Search Google for images by given query, return set of image urls
+        """
+        return self.scrape(search_engine='Google', query=query, max_urls=max_urls, **options)
 
-        while self.img_count < max_urls:
-            time.sleep(sleep)
-            #  try clicking on first image
-            thumbnail_img = self.webdriver.find_element_by_css_selector('div.serp-item__preview')
-            try:
-                thumbnail_img.click()
-                html_elem = self.webdriver.find_element_by_tag_name('html')  # where to send ARROW_DOWN key call
-                for _ in range(max_urls):
-                    time.sleep(sleep)
-                    full_img = self.webdriver.find_element_by_css_selector('img.MMImage-Origin')
-                    if full_img.get_attribute('src') and 'http' in full_img.get_attribute('src'):
-                        self.img_urls.add(full_img.get_attribute('src'))
-                    self.img_count = len(self.img_urls)
-                    html_elem.send_keys(Keys.ARROW_DOWN)
-                info_log.info(f'Got {self.img_count} image links!')
-            except Exception as err:
-                error_log.exception(f'{err}\n')
-        # close browser
-        self.webdriver.quit()
-        return self.img_urls
+    def scrape_yandex(self, query: str, max_urls: int, **options) -> set:
+        """
+        Search Yandex for images by given query, return set of image urls
+        """
+        return self.scrape(search_engine='Yandex', query=query, max_urls=max_urls, **options)
 
-    def download_image(self) -> str or None:
+    def download_image(self, workers: int = 8, connect_timeout: float = 5, read_timeout: float = 20) -> str or None:
         """
-        Download images from found urls
+        Download images from found urls concurrently
+
+        :param workers: number of download threads
+        :param connect_timeout: seconds to wait for connection
+        :param read_timeout: seconds to wait for server response
         :return:  path to subdir to open it in GUI or None if there if no urls found
         """
         if self.img_urls:
-            #  create dirs
-            dir_path = os.path.join(os.path.dirname(__file__), 'Download')
-            sub_dir_path = os.path.join(dir_path, self.sub_dir_name.capitalize())
-            if not os.path.exists(dir_path):
-                os.makedirs(dir_path)
-            if not os.path.exists(sub_dir_path):
-                os.makedirs(sub_dir_path)
+            sub_dir_path = self.download_dir()
 
             #  save image files
-            for url in self.img_urls:
-                file_name = str(datetime.now().strftime('%H-%M-%S.%f'))
-                try:
-                    file_path = os.path.join(sub_dir_path, file_name)
-                    image_content = requests.get(url=url).content
-                    image_file = io.BytesIO(image_content)
-                    image = Image.open(image_file).convert('RGB')
-                    with open(file=f'{file_path}.jpeg', mode='wb') as file:
-                        image.save(file, 'JPEG')
-                except Exception as err:
-                    error_log.exception(f'ERROR downloading {url} - {err}\n')
+            downloader = Downloader(workers=workers, connect_timeout=connect_timeout, read_timeout=read_timeout,
+                                    index=self.index, processor=self.processor,
+                                    image_filter=self.image_filter, scheduler=self.scheduler,
+                                    layout=self.layout, shard_bytes=self.shard_bytes)
+            try:
+                self.download_results = downloader.download(urls=self.img_urls, dir_path=sub_dir_path)
+            finally:
+                downloader.close()
             info_log.info(f'Successfully downloaded images by query "{self.query}" from {self.search_engine}\n')
             return sub_dir_path
         else:
             error_log.error(f'No URLs found by given query {self.query}!\n')
             return None
 
+    def _pipeline(self, urls, sub_dir_path: str, workers: int, queue_size: int = None,
+                  manifest: JobManifest = None) -> int:
+        """
+        Feeds urls to download workers through bounded queue while urls are still being found
+
+        :param urls: iterable of image urls, usually iter_image_urls() generator
+        :param sub_dir_path: where to save
+        :param workers: number of download threads
+        :param queue_size: max urls waiting for download, workers * 4 by default
+        :param manifest: JobManifest() obj to checkpoint found urls and download results
+        :return: number of urls handed to downloader
+        """
+        url_queue = queue.Queue(maxsize=queue_size or workers * 4)
+        downloader = Downloader(workers=workers, index=self.index, processor=self.processor,
+                                image_filter=self.image_filter, scheduler=self.scheduler,
+                                layout=self.layout, shard_bytes=self.shard_bytes, cancel_token=self.cancel_token)
+        on_result = manifest.add_result if manifest else None
+
+        def consume() -> None:
+            self.download_results = downloader.consume(url_queue=url_queue, dir_path=sub_dir_path,
+                                                       on_result=on_result)
+
+        consumer = threading.Thread(target=consume, name='download-consumer', daemon=True)
+        consumer.start()
+        queued = 0
+        try:
+            for url in urls:
+                if self.cancelled:
+                    break
+                if manifest:
+                    manifest.add_url(url)
+                url_queue.put(url)  # blocks while queue is full
+                queued += 1
+            if manifest and not self.cancelled:
+                manifest.mark_scraped()
+        except Exception as err:
+            error_log.exception(f'{err}\n')
+        finally:
+            for _ in range(workers):
+                url_queue.put(None)
+            consumer.join()
+            downloader.close()
+            self.close()
+            if manifest:
+                if manifest.scraped and not manifest.pending():
+                    manifest.mark_done()
+                manifest.close()
+        return queued
+
+    def scrape_and_download(self, search_engine: str, query: str, max_urls: int, workers: int = None,
+                            queue_size: int = None, manifest: JobManifest = None, **options) -> str or None:
+        """
+        Scrapes and downloads at the same time: found urls go to bounded queue
+        and download workers take them from there while scraping is still running
+
+        :param search_engine: registered engine name, e.g. Google
+        :param query: what to search
+        :param max_urls: number of images
+        :param workers: number of download threads, engine default if None
+        :param queue_size: max urls waiting for download, workers * 4 by default
+        :param manifest: JobManifest() obj to checkpoint job, so it can be resumed with resume()
+        :param options: backend extraction options
+        :return: path to subdir to open it in GUI or None if there if no urls found
+        """
+        workers = workers or (get_engine(search_engine).workers if search_engine in ENGINES else 8)
+        self.set_query(search_engine=search_engine, query=query)
+        sub_dir_path = self.download_dir()
+        if manifest:
+            manifest.start(search_engine=search_engine, query=query, max_urls=max_urls, output=sub_dir_path,
+                           options=options)
+        urls = self.iter_image_urls(search_engine=search_engine, query=query, max_urls=max_urls, **options)
+        queued = self._pipeline(urls=urls, sub_dir_path=sub_dir_path, workers=workers, queue_size=queue_size,
+                                manifest=manifest)
+
+        if queued:
+            info_log.info(f'Successfully downloaded images by query "{self.query}" from {self.search_engine}\n')
+            return sub_dir_path
+        if not os.listdir(sub_dir_path):
+            os.rmdir(sub_dir_path)
+        error_log.error(f'No URLs found by given query {self.query}!\n')
+        return None
+
+    def resume(self, manifest: JobManifest, workers: int = None, queue_size: int = None) -> str or None:
+        """
+        Continues job from manifest: downloads found urls which are not downloaded yet
+        and searches for the rest of images if search was interrupted. Finished downloads are not repeated
+
+        :param manifest: JobManifest() obj of interrupted job
+        :param workers: number of download threads, engine default if None
+        :param queue_size: max urls waiting for download, workers * 4 by default
+        :return: path to subdir or None if there is nothing to download
+        """
+        job = manifest.job
+        if job is None:
+            raise ValueError(f'Manifest {manifest.path} has no job record')
+        search_engine = job['engine']
+        workers = workers or (get_engine(search_engine).workers if search_engine in ENGINES else 8)
+        self.set_query(search_engine=search_engine, query=job['query'])
+        sub_dir_path = job['output']
+        if not os.path.exists(sub_dir_path):
+            os.makedirs(sub_dir_path)
+        missing = job['max_urls'] - len(manifest.discovered)
+        info_log.info(f'Resuming "{self.query}" from {self.search_engine}: {manifest.completed()} done, '
+                      f'{len(manifest.pending())} pending, {max(missing, 0)} to find')
+
+        def urls():
+            yield from manifest.pending()
+            if missing > 0 and not manifest.scraped:
+                yield from self.iter_image_urls(search_engine=search_engine, query=job['query'], max_urls=missing,
+                                                skip_urls=manifest.discovered, **job.get('options', {}))
+
+        queued = self._pipeline(urls=urls(), sub_dir_path=sub_dir_path, workers=workers, queue_size=queue_size,
+                                manifest=manifest)
+        return sub_dir_path if queued or manifest.completed() else None
+
+    def close(self) -> None:
+        """
+        Releases backend resources
+
+        :return: None
+        """
+
+
+class ImageScrapper(BaseScrapper):
+    """
+    Scraps image from search engine with headless Chrome and downloads it to 'Download' dir
+    """
+
+    def __init__(self, pool: DriverPool = None, url_templates: dict = None):
+        """
+        :param pool: DriverPool() obj to borrow warm browser from, own browser is started if None
+        :param url_templates: engine name -> result page url template overriding engine url_template
+        """
+        super().__init__()
+        self.url_templates = url_templates or {}
+        self.pool = pool
+        self.webdriver = pool.acquire() if pool else create_driver()
+        self._closed = False
+        self.result_start = 0
+        self.waiter = AdaptiveWait()  # learns page latency across queries of this session
+
+    def scroll_to_end(self, sleep: int = 2) -> None:
+        """
+        Scrolls to the bottom and waits until page grows
+
+        :param sleep: max wait for new content
+        :return: None
+        """
+        height = self.webdriver.execute_script('let height = document.body.scrollHeight; '
+                                               'window.scrollTo(0, height); return height;')
+        self.waiter.until(lambda: self.webdriver.execute_script('return document.body.scrollHeight;') > height,
+                          max_timeout=sleep)
+
+    def run_batch(self, script: str, count: int, sleep: int, *args) -> list:
+        """
+        Runs async batch script from page_scripts, feeds step latencies to waiter.
+        Used by engines in batch extraction
+
+        :param script: batch script
+        :param count: number of steps in batch
+        :param sleep: max wait per step
+        :param args: script arguments before count
+        :return: list of src strings collected by in-page observer
+        """
+        timeout = self.waiter.timeout(max_timeout=sleep)
+        self.webdriver.set_script_timeout(count * timeout + 10)
+        with METRICS.timer('browser_batch_seconds', engine=self.search_engine):
+            result = self.webdriver.execute_async_script(script, *args, count, int(timeout * 1000))
+        for latency in result['latencies']:
+            self.waiter.observe(timeout if latency is None else latency)
+        return result['srcs']
+
+    def _raw_urls(self, search_engine: str, query: str, sleep: float = None, patience: int = None,
+                  extraction: str = 'batch', batch_size: int = None, thumbnails: bool = False):
+        """
+        Opens result page and yields full size image urls, None options take engine tunables
+
+        :param search_engine: registered engine name, e.g. Google
+        :param query: what to search
+        :param sleep: max wait between interactions
+        :param patience: interactions without new results before giving up
+        :param extraction: 'batch' to collect urls inside the page in batches or 'element' for webdriver calls
+            per element
+        :param batch_size: thumbnails handled per webdriver round trip in batch extraction
+        :param thumbnails: yield thumbnails of result page instead, data URIs and thumbnail urls, no clicks
+        :return: generator of urls
+        """
+        engine = get_engine(search_engine)
+        with METRICS.timer('page_load_seconds', engine=search_engine, backend='browser'):
+            self.webdriver.get(url=engine.search_url(query=query, template=self.url_templates.get(search_engine)))
+        if thumbnails:
+            yield from engine.browser_thumbnails(self, sleep=sleep or engine.sleep,
+                                                 patience=patience or engine.patience)
+            return
+        yield from engine.browser_urls(self, sleep=sleep or engine.sleep, patience=patience or engine.patience,
+                                       extraction=extraction, batch_size=batch_size or engine.batch_size)
+
+    def close(self) -> None:
+        """
+        Returns browser to pool or closes it if it is not pooled
+
+        :return: None
+        """
+        if self._closed:
+            return
+        self._closed = True
+        if self.pool:
+            self.pool.release(self.webdriver)
+        else:
+            self.webdriver.quit()
+
+
+class HttpScrapper(BaseScrapper):
+    """
+    Scraps image urls from result pages with plain http requests, no browser needed.
+    url_templates let it run against other hosts, e.g. saved pages served from local server
+    """
+
+    def __init__(self, url_templates: dict = None, connect_timeout: float = 5, read_timeout: float = 20):
+        """
+        :param url_templates: engine name -> result page url template overriding engine url_template
+        :param connect_timeout: seconds to wait for connection
+        :param read_timeout: seconds to wait for server response
+        """
+        super().__init__()
+        self.url_templates = url_templates or {}
+        self.timeout = (connect_timeout, read_timeout)
+        self.session = requests.Session()
+        self.session.headers['User-Agent'] = USER_AGENT
+        self.session.headers['Accept-Language'] = 'en-US,en;q=0.9'
+
+    def _raw_urls(self, search_engine: str, query: str, max_pages: int = None, thumbnails: bool = False):
+        """
+        Requests result pages one by one and yields image urls parsed from them,
+        stops when page brings nothing new
+
+        :param search_engine: registered engine name, e.g. Google
+        :param query: what to search
+        :param max_pages: max number of result pages, engine default if None
+        :param thumbnails: yield thumbnails embedded in page as data URIs and thumbnail urls instead
+        :return: generator of urls
+        """
+        engine = get_engine(search_engine)
+        template = self.url_templates.get(search_engine)
+        previous = set()
+        for page in range(max_pages or engine.max_pages):
+            if self.cancelled:
+                return
+            with METRICS.timer('page_load_seconds', engine=search_engine, backend='http'):
+                response = self.session.get(url=engine.page_url(query=query, page=page, template=template),
+                                            timeout=self.timeout)
+            response.raise_for_status()
+            found = engine.parse_thumbnails(response.text) if thumbnails else engine.parse_page(response.text)
+            info_log.info(f'Found {len(found)} image links on page {page}')
+            if not set(found) - previous:
+                break
+            previous = set(found)
+            yield from found
+        info_log.info(f'No more results for "{self.query}"')
+
+    def close(self) -> None:
+        """
+        Closes http session
+
+        :return: None
+        """
+        self.session.close()
+
+
+class MultiScrapper(BaseScrapper):
+    """
+    Queries several engines at the same time, every engine runs in its own thread with its own backend scrapper.
+    Url streams are merged and deduped by normalized url, engines stop as soon as combined target is reached
+    """
+
+    def __init__(self, backend: str = 'browser', engines: list = None, **kwargs):
+        """
+        :param backend: 'browser' or 'http'
+        :param engines: engine names, all registered engines by default
+        :param kwargs: backend constructor args
+        """
+        super().__init__()
+        self.backend = backend
+        self.engines = engines or list(ENGINES)
+        self.kwargs = kwargs
+        self.engine_counts = {}
+
+    def iter_image_urls(self, search_engine: str, query: str, max_urls: int, dedup: str = 'hash',
+                        stop_event: threading.Event = None, skip_urls=None, **options):
+        """
+        Search all engines for images by given query, yield urls as soon as any engine finds them
+
+        :param search_engine: MULTI_ENGINE, kept for the same interface as other scrappers
+        :param query: what to search
+        :param max_urls: combined number of images
+        :param dedup: 'hash' for exact hashed url set or 'bloom' for fixed size bloom filter
+        :param stop_event: threading.Event() obj, search stops when it is set
+        :param skip_urls: container of urls which are already known, e.g. from manifest
+        :param options: backend extraction options passed to every engine
+        :return: generator of urls
+        """
+        self.set_query(search_engine=MULTI_ENGINE, query=query)
+        self.img_count = 0
+        self.engine_counts = {name: 0 for name in self.engines}
+        seen = make_url_set(dedup=dedup, capacity=max(max_urls * 2, 1000))
+        stop = threading.Event()
+        merged = queue.Queue()
+
+        def produce(engine_name: str) -> None:
+            try:
+                scrapper = create_scrapper(backend=self.backend, **self.kwargs)
+                scrapper.cancel_token = self.cancel_token
+            except Exception as err:
+                error_log.exception(f'{engine_name} failed to start - {err}\n')
+                merged.put((engine_name, None))
+                return
+            try:
+                for url in scrapper.iter_image_urls(search_engine=engine_name, query=query, max_urls=max_urls,
+                                                    dedup=dedup, stop_event=stop, **options):
+                    merged.put((engine_name, url))
+            except Exception as err:
+                error_log.exception(f'{engine_name} failed - {err}\n')
+            finally:
+                scrapper.close()
+                merged.put((engine_name, None))  # engine is done
+
+        threads = [threading.Thread(target=produce, args=(name,), name=f'search-{name}', daemon=True)
+                   for name in self.engines]
+        for thread in threads:
+            thread.start()
+        running = len(threads)
+        try:
+            while running:
+                engine_name, url = merged.get()
+                if url is None:
+                    running -= 1
+                    continue
+                if stop_event is not None and stop_event.is_set() or self.cancelled:
+                    break
+                if self._is_known(url=url, seen=seen, skip_urls=skip_urls):
+                    continue
+                seen.add(url_key(url))
+                self.img_count += 1
+                self.engine_counts[engine_name] += 1
+                yield url
+                if self.img_count >= max_urls:
+                    info_log.info(f'Got {self.img_count} image links! By engine: {self.engine_counts}')
+                    break
+        finally:
+            stop.set()
+            for thread in threads:
+                thread.join()
+
+
+BACKENDS = {'browser': ImageScrapper, 'http': HttpScrapper}
+
+
+def create_scrapper(backend: str = 'browser', search_engine: str = None, **kwargs) -> BaseScrapper:
+    """
+    Creates scrapper for chosen backend
+
+    :param backend: 'browser' or 'http'
+    :param search_engine: MULTI_ENGINE to get MultiScrapper, otherwise it is not needed
+    :param kwargs: backend constructor args
+    :return: scrapper obj
+    """
+    if backend not in BACKENDS:
+        raise ValueError(f'No such backend {backend}')
+    if search_engine == MULTI_ENGINE:
+        return MultiScrapper(backend=backend, **kwargs)
+    return BACKENDS[backend](**kwargs)
+
 
 if __name__ == '__main__':
     scrapper = ImageScrapper()
@@ -0,0 +1,309 @@
+#! /usr/bin/env python3
+import io
+import re
+import sys
+import json
+import zlib
+import base64
+import html
+import time
+import random
+import argparse
+import threading
+from functools import lru_cache
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qs
+from PIL import Image
+
+"""
+Local stand-in for search engines and image hosts: serves synthetic result pages and generated images,
+injects latency and errors, so scraping and downloading can be tried and measured without network
+
+GET /google?q=<query>[&ijn=<page>]  Google-like page: img.Q4LuWd thumbnails, .mye4qd more button,
+                                    img.n3VNCb viewer and embedded ["url",h,w] data for http backend
+GET /yandex?text=<query>[&p=<page>] Yandex-like page: div.serp-item__preview items with img_href data-bem,
+                                    img.serp-item__thumb thumbnails, img.MMImage-Origin viewer flipped by ARROW_DOWN
+GET /images?q=tbn:<seed>            Google-like thumbnail, first inline_thumbnails Google results embed it as data URI
+GET /i?id=<seed>                    Yandex-like thumbnail
+GET /img/<seed>.<jpg|png>?w=640&h=480&delay=0.2&fail=503&fail_rate=0.3
+    delay      seconds before response
+    fail       status code of injected error, 503 by default
+    fail_rate  share of requests answered with error
+    fail_first number of first requests of the path answered with error
+Range requests are supported, so header probing works as with real hosts.
+Result pages link images with server config: size, delay and fail_rate.
+
+Usage: python standin.py --port 8800 --results 500 --delay 0.05 --fail-rate 0.02
+"""
+
+_IMG_RE = re.compile(r'^/img/(\d+)\.(jpg|png)$')
+#  server config, result pages link images with these params
+DEFAULT_CONFIG = {
+    'results': 200,  # results per query
+    'page_size': 50,  # results per page and per "more" click
+    'width': 640,
+    'height': 480,
+    'delay': 0.0,  # image response latency
+    'fail_rate': 0.0,  # share of failed image responses
+    'page_delay': 0.0,  # result page latency
+    'viewer_delay': 20,  # ms before viewer shows full size image
+    'thumb_width': 160,
+    'thumb_height': 120,
+    'inline_thumbnails': 20,  # Google results with data URI thumbnail, the rest is lazy loaded from data-src
+}
+_THUMBNAIL = 'data:image/gif;base64,R0lGODlhAQABAAAAACw='
+
+_GOOGLE_PAGE = '''<!DOCTYPE html><html><head><title>{title}</title></head><body>
+<div id="results"></div>
+<input type="button" class="mye4qd" value="Show more results" onclick="more()">
+<img class="n3VNCb" alt="">
+<script>AF_initDataCallback({{key: 'ds:1', data: {data}}});</script>
+<script>
+const all = {urls}, thumbs = {thumbs}, pageSize = {page_size}, viewerDelay = {viewer_delay};
+const results = document.getElementById('results'), viewer = document.querySelector('img.n3VNCb');
+let shown = 0;
+function more() {{
+    for (const end = Math.min(all.length, shown + pageSize); shown < end; shown++) {{
+        const img = document.createElement('img'), i = shown;
+        img.className = 'Q4LuWd';
+        img.src = thumbs[i][0];
+        if (thumbs[i][1]) img.dataset.src = thumbs[i][1];
+        img.style = 'display: block; width: 100px; height: 100px';
+        img.onclick = () => setTimeout(() => {{ viewer.src = all[i]; }}, viewerDelay);
+        results.appendChild(img);
+    }}
+}}
+more();
+</script></body></html>'''
+
+_YANDEX_PAGE = '''<!DOCTYPE html><html><head><title>{title}</title></head><body>
+{items}
+<img class="MMImage-Origin" alt="">
+<script>
+const all = {urls}, viewerDelay = {viewer_delay};
+const viewer = document.querySelector('img.MMImage-Origin');
+let current = -1;
+const show = i => {{
+    if (i < all.length) {{ current = i; setTimeout(() => {{ viewer.src = all[i]; }}, viewerDelay); }}
+}};
+document.querySelectorAll('div.serp-item__preview').forEach((item, i) => item.onclick = () => show(i));
+document.addEventListener('keydown', event => {{
+    if (current >= 0 && (event.key === 'ArrowDown' || event.keyCode === 40)) show(current + 1);
+}});
+</script></body></html>'''
+_YANDEX_ITEM = ('<div class="serp-item" data-bem=\'{{"serp-item":{{"img_href":"{url}"}}}}\'>'
+                '<div class="serp-item__preview"><img class="serp-item__thumb" src="{thumb}"></div></div>')
+
+
+@lru_cache(maxsize=256)
+def generate_image(seed: int, width: int, height: int, image_format: str) -> bytes:
+    """
+    Deterministic noisy image, different seeds give images which are not near duplicates
+
+    :param seed: image seed
+    :param width: width in px
+    :param height: height in px
+    :param image_format: JPEG or PNG
+    :return: file content
+    """
+    rnd = random.Random(seed)
+    grid = Image.frombytes('L', (8, 8), bytes(rnd.randrange(256) for _ in range(64)))
+    image = grid.resize((width, height), Image.BILINEAR).convert('RGB')
+    output = io.BytesIO()
+    image.save(output, image_format)
+    return output.getvalue()
+
+
+def _first_seed(query: str) -> int:
+    return zlib.crc32(query.encode('UTF-8')) % 100_000 * 10_000
+
+
+def result_urls(config: dict, base: str, query: str) -> list:
+    """
+    Image urls of query, the same query gets the same images
+
+    :param config: server config
+    :param base: server url
+    :param query: search query
+    :return: list of urls
+    """
+    first_seed = _first_seed(query)
+    params = f'w={config["width"]}&h={config["height"]}'
+    if config['delay']:
+        params += f'&delay={config["delay"]}'
+    if config['fail_rate']:
+        params += f'&fail_rate={config["fail_rate"]}'
+    return [f'{base}/img/{first_seed + i}.{"png" if i % 5 == 4 else "jpg"}?{params}'
+            for i in range(config['results'])]
+
+
+def thumbnail(config: dict, seed: int) -> bytes:
+    """
+    Thumbnail of result image
+
+    :param config: server config
+    :param seed: image seed
+    :return: JPEG content
+    """
+    return generate_image(seed, config['thumb_width'], config['thumb_height'], 'JPEG')
+
+
+def result_page(config: dict, base: str, engine: str, params: dict) -> str:
+    """
+    Synthetic result page with the same selectors as real engine
+
+    :param config: server config
+    :param base: server url
+    :param engine: 'google' or 'yandex'
+    :param params: query params of page request
+    :return: html
+    """
+    query = params.get('q') or params.get('text') or ''
+    page = int(params.get('ijn') or params.get('p') or 0)
+    offset = page * config['page_size']
+    first_seed = _first_seed(query) + offset
+    #  viewer of browser page goes on from the first result of page to the last one
+    urls = result_urls(config, base=base, query=query)[offset:]
+    page_urls = urls[:config['page_size']]
+    if engine == 'google':
+        #  thumbnail is [src, data-src], first results are inlined, the rest is lazy loaded
+        thumbs = [[f'data:image/jpeg;base64,{base64.b64encode(thumbnail(config, first_seed + i)).decode()}', '']
+                  if offset + i < config['inline_thumbnails'] else
+                  [_THUMBNAIL, f'{base}/images?q=tbn:{first_seed + i}'] for i in range(len(urls))]
+        #  browser page shows more results by button, http backend gets page by ijn
+        data = []
+        for i, url in enumerate(page_urls):
+            if thumbs[i][1]:
+                data.append([thumbs[i][1], config['thumb_height'], config['thumb_width']])
+            data.append([url, config['height'], config['width']])
+        return _GOOGLE_PAGE.format(title=html.escape(query), data=json.dumps(data, separators=(',', ':')),
+                                   urls=json.dumps(urls), thumbs=json.dumps(thumbs), page_size=config['page_size'],
+                                   viewer_delay=config['viewer_delay'])
+    items = '\n'.join(_YANDEX_ITEM.format(url=url, thumb=html.escape(f'{base}/i?id={first_seed + i}&n=13'))
+                      for i, url in enumerate(page_urls))
+    return _YANDEX_PAGE.format(title=html.escape(query), items=items, urls=json.dumps(urls),
+                               viewer_delay=config['viewer_delay'])
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keep-alive like real hosts
+    hits = {}
+    hits_lock = threading.Lock()
+
+    def log_message(self, format, *args) -> None:
+        pass  # quiet, stand-in runs next to benchmarks
+
+    def _count_hit(self, path: str) -> int:
+        with self.hits_lock:
+            self.hits[path] = self.hits.get(path, 0) + 1
+            return self.hits[path]
+
+    def _send(self, status: int, body: bytes = b'', content_type: str = 'text/plain', headers: dict = None) -> None:
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(body)
+
+    def do_HEAD(self) -> None:
+        self.do_GET()
+
+    def do_GET(self) -> None:
+        parts = urlsplit(self.path)
+        params = {key: values[0] for key, values in parse_qs(parts.query).items()}
+        hit = self._count_hit(self.path)
+        time.sleep(float(params.get('delay', 0)))
+        if hit <= int(params.get('fail_first', 0)) or random.random() < float(params.get('fail_rate', 0)):
+            status = int(params.get('fail', 503))
+            self._send(status, headers={'Retry-After': '0'} if status == 429 else None)
+            return
+
+        if parts.path in ('/google', '/yandex'):
+            config = self.server.config
+            time.sleep(config['page_delay'])
+            base = f'http://{self.server.server_address[0]}:{self.server.server_port}'
+            page = result_page(config, base=base, engine=parts.path[1:], params=params)
+            self._send(200, page.encode('UTF-8'), 'text/html; charset=utf-8')
+            return
+
+        if parts.path in ('/images', '/i'):
+            seed = params.get('q', '').rpartition(':')[2] if parts.path == '/images' else params.get('id', '')
+            if seed.isdigit():
+                self._send(200, thumbnail(self.server.config, int(seed)), 'image/jpeg')
+            else:
+                self._send(404)
+            return
+
+        match = _IMG_RE.match(parts.path)
+        if not match:
+            self._send(404)
+            return
+        image_format = 'JPEG' if match.group(2) == 'jpg' else 'PNG'
+        body = generate_image(int(match.group(1)), int(params.get('w', 640)), int(params.get('h', 480)),
+                              image_format)
+        content_type = f'image/{image_format.lower()}'
+        byte_range = re.match(r'bytes=(\d+)-(\d*)$', self.headers.get('Range', ''))
+        if byte_range:
+            first = int(byte_range.group(1))
+            last = min(int(byte_range.group(2) or len(body) - 1), len(body) - 1)
+            self._send(206, body[first:last + 1], content_type,
+                       headers={'Content-Range': f'bytes {first}-{last}/{len(body)}'})
+        else:
+            self._send(200, body, content_type)
+
+
+class StandInServer(ThreadingHTTPServer):
+    daemon_threads = True
+    config = DEFAULT_CONFIG
+
+    def handle_error(self, request, client_address) -> None:
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)  # clients drop probed connections on purpose
+
+
+def serve(port: int = 0, handler=StandInHandler, **config) -> ThreadingHTTPServer:
+    """
+    Starts stand-in server in background thread
+
+    :param port: port to listen on localhost, any free port if 0
+    :param handler: request handler class
+    :param config: overrides of DEFAULT_CONFIG
+    :return: server, its base url is http://127.0.0.1:{server.server_port}
+    """
+    server = StandInServer(('127.0.0.1', port), handler)
+    server.config = {**DEFAULT_CONFIG, **config}
+    threading.Thread(target=server.serve_forever, name='stand-in', daemon=True).start()
+    return server
+
+
+def url_templates(server: ThreadingHTTPServer) -> dict:
+    """
+    Scrapper url_templates pointing engines to stand-in
+
+    :param server: serve() result
+    :return: engine name -> result page url template
+    """
+    base = f'http://127.0.0.1:{server.server_port}'
+    return {'Google': f'{base}/google?q={{q}}', 'Yandex': f'{base}/yandex?text={{q}}'}
+
+
+def main(argv: list = None) -> int:
+    parser = argparse.ArgumentParser(description='Local stand-in for search engines and image hosts')
+    parser.add_argument('--port', type=int, default=8800)
+    for name, value in DEFAULT_CONFIG.items():
+        parser.add_argument(f'--{name.replace("_", "-")}', type=type(value), default=value)
+    args = parser.parse_args(argv)
+    server = serve(port=args.port, **{name: getattr(args, name) for name in DEFAULT_CONFIG})
+    print(f'Serving on http://127.0.0.1:{server.server_port}, Ctrl+C to stop')
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,152 @@
+#! /usr/bin/env python3
+import os
+import json
+import time
+import tarfile
+import zipfile
+import threading
+
+"""
+Output layouts. Files are named by sha256 of downloaded content, so parallel writers and reruns never collide
+and the same image is stored once:
+
+    flat     <dir>/<sha256>.<ext>
+    sharded  <dir>/<sha256[:2]>/<sha256[2:4]>/<sha256>.<ext>, keeps directories small
+    tar, zip <dir>/shard-00001.tar ... capped by shard_bytes, <dir>/index.jsonl tells where every image is
+"""
+
+LAYOUTS = ('flat', 'sharded', 'tar', 'zip')
+SHARD_BYTES = 1024 ** 3
+INDEX_NAME = 'index.jsonl'
+
+
+class FileStorage:
+    """
+    Moves finished files into dir_path under content address
+    """
+
+    def __init__(self, dir_path: str, sharded: bool = False):
+        """
+        :param dir_path: output dir
+        :param sharded: put files in two levels of subdirs by hash prefix
+        """
+        self.dir_path = dir_path
+        self.sharded = sharded
+
+    def store(self, src_path: str, sha256: str, extension: str, url: str) -> str:
+        """
+        Moves file to its content address, file with the same content is replaced by identical one
+
+        :param src_path: finished file, removed after store
+        :param sha256: hash of downloaded content
+        :param extension: file extension
+        :param url: image url
+        :return: stored file path
+        """
+        sub_dir = os.path.join(self.dir_path, sha256[:2], sha256[2:4]) if self.sharded else self.dir_path
+        os.makedirs(sub_dir, exist_ok=True)
+        path = os.path.join(sub_dir, f'{sha256}.{extension}')
+        os.replace(src_path, path)
+        return path
+
+    def close(self) -> None:
+        pass
+
+
+class ArchiveStorage:
+    """
+    Appends finished files to tar or zip shards of at most shard_bytes and records them in index.jsonl.
+    Shards of earlier runs are kept, new run starts new shard. Content already in any shard is not added again
+    """
+
+    def __init__(self, dir_path: str, kind: str = 'tar', shard_bytes: int = SHARD_BYTES):
+        """
+        :param dir_path: output dir
+        :param kind: 'tar' or 'zip'
+        :param shard_bytes: max size of one shard, single bigger file gets its own shard
+        """
+        self.dir_path = dir_path
+        self.kind = kind
+        self.shard_bytes = shard_bytes
+        self._lock = threading.Lock()
+        self._archive = None
+        self._shard_name = None
+        self._shard_size = 0
+        self._shard_number = sum(name.endswith(f'.{kind}') for name in os.listdir(dir_path))
+        index_path = os.path.join(dir_path, INDEX_NAME)
+        self._stored = {}  # member -> shard
+        if os.path.exists(index_path):
+            with open(file=index_path, mode='r', encoding='UTF-8') as file:
+                for line in file:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        break  # line cut by crash
+                    self._stored[record['member']] = record['shard']
+        self._index = open(file=index_path, mode='a', encoding='UTF-8', buffering=1)
+
+    def _open_shard(self) -> None:
+        self._close_shard()
+        self._shard_number += 1
+        self._shard_name = f'shard-{self._shard_number:05}.{self.kind}'
+        path = os.path.join(self.dir_path, self._shard_name)
+        if self.kind == 'tar':
+            self._archive = tarfile.open(name=path, mode='w')
+        else:
+            #  images are compressed already
+            self._archive = zipfile.ZipFile(file=path, mode='w', compression=zipfile.ZIP_STORED)
+        self._shard_size = 0
+
+    def _close_shard(self) -> None:
+        if self._archive is not None:
+            self._archive.close()
+            self._archive = None
+
+    def store(self, src_path: str, sha256: str, extension: str, url: str) -> str:
+        """
+        Appends file to current shard
+
+        :param src_path: finished file, removed after store
+        :param sha256: hash of downloaded content
+        :param extension: file extension
+        :param url: image url
+        :return: <dir>/<shard>/<member> path
+        """
+        member = f'{sha256}.{extension}'
+        size = os.path.getsize(src_path)
+        with self._lock:
+            if member not in self._stored:
+                if self._archive is None or self._shard_size and self._shard_size + size > self.shard_bytes:
+                    self._open_shard()
+                if self.kind == 'tar':
+                    self._archive.add(name=src_path, arcname=member)
+                else:
+                    self._archive.write(filename=src_path, arcname=member)
+                self._stored[member] = self._shard_name
+                self._shard_size += size
+                self._index.write(json.dumps({'sha256': sha256, 'shard': self._shard_name, 'member': member,
+                                              'size': size, 'url': url, 'added': time.time()}) + '\n')
+            shard = self._stored[member]
+        os.remove(src_path)
+        return os.path.join(self.dir_path, shard, member)
+
+    def close(self) -> None:
+        with self._lock:
+            self._close_shard()
+            self._index.close()
+
+
+def make_storage(layout: str, dir_path: str, shard_bytes: int = SHARD_BYTES):
+    """
+    Creates storage for output dir
+
+    :param layout: one of LAYOUTS
+    :param dir_path: output dir
+    :param shard_bytes: max size of tar or zip shard
+    :return: storage obj with store() and close()
+    """
+    if layout in ('flat', 'sharded'):
+        return FileStorage(dir_path=dir_path, sharded=layout == 'sharded')
+    if layout in ('tar', 'zip'):
+        return ArchiveStorage(dir_path=dir_path, kind=layout, shard_bytes=shard_bytes)
+    raise ValueError(f'Unknown output layout {layout}')
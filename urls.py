@@ -0,0 +1,159 @@
+#! /usr/bin/env python3
+import math
+import hashlib
+from urllib.parse import urlsplit, urlunsplit
+
+"""
+Url normalization and compact dedup structures
+"""
+
+DEFAULT_PORTS = {'http': 80, 'https': 443}
+#  click and campaign tracking params, utm_* are dropped as well
+TRACKING_PARAMS = {'fbclid', 'gclid', 'dclid', 'yclid', 'msclkid', 'igshid', 'mc_cid', 'mc_eid', '_openstat'}
+
+
+def normalize_url(url: str) -> str or None:
+    """
+    Canonical form of image url: lowercase scheme and host, no default port,
+    no fragment and no tracking params
+
+    :param url: raw url from page
+    :return: normalized url or None if it is not http(s) url
+    """
+    if not url:
+        return None
+    try:
+        parts = urlsplit(url.strip())
+        port = parts.port
+    except ValueError:
+        return None
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or '').rstrip('.')
+    if scheme not in ('http', 'https') or not host:
+        return None
+    netloc = f'[{host}]' if ':' in host else host
+    if port not in (None, DEFAULT_PORTS[scheme]):
+        netloc = f'{netloc}:{port}'
+    if parts.username:
+        netloc = f'{parts.netloc.rpartition("@")[0]}@{netloc}'
+    #  params are filtered as raw strings, so signed CDN urls keep their exact encoding
+    query = '&'.join(param for param in parts.query.split('&')
+                     if param and not _is_tracking(param.partition('=')[0].lower()))
+    return urlunsplit((scheme, netloc, parts.path or '/', query, ''))
+
+
+def is_data_uri(url: str) -> bool:
+    """
+    Checks if url is base64 image embedded in page, e.g. thumbnail
+
+    :param url: url
+    :return: bool
+    """
+    return url.startswith('data:image/') and ';base64,' in url[:64]
+
+
+def short_url(url: str, limit: int = 120) -> str:
+    """
+    Url cut for logs, data URIs are kilobytes long
+
+    :param url: url
+    :param limit: max length
+    :return: str
+    """
+    return url if len(url) <= limit else f'{url[:limit]}...'
+
+
+def _is_tracking(key: str) -> bool:
+    return key.startswith('utm_') or key in TRACKING_PARAMS
+
+
+def url_key(url: str) -> str:
+    """
+    Dedup key of normalized url: same image served over http and https or with and without www
+    gets the same key
+
+    :param url: normalized url
+    :return: key
+    """
+    parts = urlsplit(url)
+    host = parts.netloc[4:] if parts.netloc.startswith('www.') else parts.netloc
+    return f'{host}{parts.path}?{parts.query}'
+
+
+def url_digest(url: str, size: int = 8) -> bytes:
+    """
+    Short stable hash of url
+
+    :param url: url
+    :param size: digest size in bytes
+    :return: digest
+    """
+    return hashlib.blake2b(url.encode('UTF-8'), digest_size=size).digest()
+
+
+class HashedUrlSet:
+    """
+    Set of urls which keeps only 64-bit hashes instead of url strings.
+    False positive chance is negligible for millions of urls
+    """
+
+    def __init__(self):
+        self._hashes = set()
+
+    def __contains__(self, url: str) -> bool:
+        return int.from_bytes(url_digest(url), 'big') in self._hashes
+
+    def __len__(self) -> int:
+        return len(self._hashes)
+
+    def add(self, url: str) -> None:
+        self._hashes.add(int.from_bytes(url_digest(url), 'big'))
+
+
+class BloomFilter:
+    """
+    Fixed size probabilistic set of urls, memory does not grow with number of urls.
+    May report unseen url as seen with error_rate probability when capacity is not exceeded
+    """
+
+    def __init__(self, capacity: int = 100_000, error_rate: float = 0.001):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.bit_count = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hash_count = max(1, round(self.bit_count / capacity * math.log(2)))
+        self._bits = bytearray((self.bit_count + 7) // 8)
+        self._count = 0
+
+    def _positions(self, url: str):
+        #  double hashing: position_i = h1 + i * h2
+        digest = url_digest(url, size=16)
+        h1 = int.from_bytes(digest[:8], 'big')
+        h2 = int.from_bytes(digest[8:], 'big') | 1
+        for i in range(self.hash_count):
+            yield (h1 + i * h2) % self.bit_count
+
+    def __contains__(self, url: str) -> bool:
+        return all(self._bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(url))
+
+    def __len__(self) -> int:
+        return self._count
+
+    def add(self, url: str) -> None:
+        for pos in self._positions(url):
+            self._bits[pos >> 3] |= 1 << (pos & 7)
+        self._count += 1
+
+
+def make_url_set(dedup: str = 'hash', capacity: int = 100_000):
+    """
+    Creates url set for dedup
+
+    :param dedup: 'hash' for HashedUrlSet or 'bloom' for BloomFilter
+    :param capacity: expected number of urls, used by bloom filter
+    :return: set-like obj with add() and __contains__
+    """
+    if dedup == 'hash':
+        return HashedUrlSet()
+    if dedup == 'bloom':
+        return BloomFilter(capacity=capacity)
+    raise ValueError(f'Unknown dedup method {dedup}')
@@ -0,0 +1,80 @@
+#! /usr/bin/env python3
+import time
+from metrics import METRICS
+
+"""
+Condition based waiting for page interactions
+"""
+
+
+class AdaptiveWait:
+    """
+    Polls condition until it holds instead of sleeping fixed time.
+    Timeout follows page latency seen in the session: factor * moving average,
+    limited by min_timeout and max_timeout
+    """
+
+    def __init__(self, max_timeout: float = 2.0, min_timeout: float = 0.3, poll: float = 0.05,
+                 factor: float = 3.0, alpha: float = 0.2):
+        self.max_timeout = max_timeout
+        self.min_timeout = min_timeout
+        self.poll = poll
+        self.factor = factor
+        self.alpha = alpha
+        self.latency = None  # exponential moving average of successful waits
+        self.waits = 0
+        self.timeouts = 0
+
+    def observe(self, elapsed: float) -> None:
+        """
+        Adds wait duration to moving average
+
+        :param elapsed: seconds
+        :return: None
+        """
+        if self.latency is None:
+            self.latency = elapsed
+        else:
+            self.latency += self.alpha * (elapsed - self.latency)
+
+    def timeout(self, max_timeout: float = None) -> float:
+        """
+        Current timeout
+
+        :param max_timeout: overrides max_timeout for this call
+        :return: seconds
+        """
+        cap = self.max_timeout if max_timeout is None else max_timeout
+        if self.latency is None:
+            return cap
+        return min(cap, max(self.min_timeout, self.latency * self.factor))
+
+    def until(self, condition, max_timeout: float = None):
+        """
+        Calls condition until it returns truthy value or timeout expires.
+        Exceptions raised by condition (stale or missing elements) count as not ready yet
+
+        :param condition: callable without args
+        :param max_timeout: overrides max_timeout for this call
+        :return: condition result or None on timeout
+        """
+        timeout = self.timeout(max_timeout=max_timeout)
+        start = time.perf_counter()
+        self.waits += 1
+        while True:
+            try:
+                result = condition()
+            except Exception:
+                result = None
+            elapsed = time.perf_counter() - start
+            if result:
+                self.observe(elapsed)
+                METRICS.observe('wait_seconds', elapsed, outcome='ready')
+                return result
+            if elapsed >= timeout:
+                #  slow page pushes average up so next waits are more patient
+                self.observe(timeout)
+                self.timeouts += 1
+                METRICS.observe('wait_seconds', elapsed, outcome='timeout')
+                return None
+            time.sleep(self.poll)